@@ -1,11 +1,25 @@
 # -*- coding: utf-8 -*-
 
 """Console script for snmp_adapter."""
+
+import ipaddress
 import sys
 
 import click
 
-from snmp_adapter.experiments import snmp, xml, db
+from snmp_adapter.experiments import (
+    capture,
+    compress,
+    control,
+    discover,
+    output,
+    pgstore,
+    serve,
+    snmp,
+    usm,
+    xml,
+    db,
+)
 
 
 # From Click documentation
@@ -69,17 +83,90 @@ def common():
     return 0
 
 
+def _v3_options(function):
+    """Decorator adding the SNMPv3 user options to a command."""
+    options = (
+        click.option("-u", "--user", help="SNMPv3 user name.  Enables SNMPv3."),
+        click.option("--auth-key", help="SNMPv3 authentication pass phrase."),
+        click.option(
+            "--auth-protocol",
+            type=click.Choice(sorted(usm.AUTH_PROTOCOLS), case_sensitive=False),
+            help="SNMPv3 authentication protocol.  [default: SHA if --auth-key]",
+        ),
+        click.option("--priv-key", help="SNMPv3 privacy (encryption) pass phrase."),
+        click.option(
+            "--priv-protocol",
+            type=click.Choice(sorted(usm.PRIV_PROTOCOLS), case_sensitive=False),
+            help="SNMPv3 privacy protocol.  [default: AES if --priv-key]",
+        ),
+        click.option(
+            "--key-cache",
+            default=usm.DEFAULT_KEY_CACHE,
+            show_default=True,
+            type=click.Path(dir_okay=False),
+            help="File in which to cache SNMPv3 keys derived from pass phrases.",
+        ),
+    )
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def _format_option(function):
+    """Decorator adding the output format option to a command."""
+    return click.option(
+        "-f",
+        "--format",
+        "output_format",
+        type=click.Choice(output.FORMATS),
+        default=output.DEFAULT_FORMAT,
+        show_default=True,
+        help="Output format.  Structured formats are buffered and written in bulk.",
+    )(function)
+
+
+def _make_v3_user(user, auth_key, auth_protocol, priv_key, priv_protocol):
+    """Returns a usm.V3User from the _v3_options() values, or None if no user."""
+    if not user:
+        return None
+    return usm.make_user(user, auth_key, priv_key, auth_protocol, priv_protocol)
+
+
 @snmp_group.command()
-def temperature():
+@_v3_options
+@_format_option
+@click.option(
+    "-i",
+    "--inventory",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Read every X-410 in this inventory from snmp discover.",
+)
+def temperature(
+    user,
+    auth_key,
+    auth_protocol,
+    priv_key,
+    priv_protocol,
+    key_cache,
+    output_format,
+    inventory,
+):
     """One-Wire Temperature sensor on ControlByWeb X-410 module."""
-    snmp.temperature()
+    user = _make_v3_user(user, auth_key, auth_protocol, priv_key, priv_protocol)
+    devices = discover.x410_devices(inventory) if inventory else None
+    writer = output.BufferedWriter(output_format)
+    snmp.temperature(user, usm.KeyCache(key_cache), writer, devices)
+    writer.close()
     return 0
 
 
 @snmp_group.command()
-def rewrite():
+@_format_option
+def rewrite(output_format):
     """PySNMP Tutorial Common Operations Example, rewritten."""
-    snmp.rewrite()
+    writer = output.BufferedWriter(output_format)
+    snmp.rewrite(writer)
+    writer.close()
     return 0
 
 
@@ -114,9 +201,273 @@ def rewrite():
     nargs=1,
     help="Load extra SNMP MIB(s) for nicer output.  Use multiple times to add multiple MIBs.",
 )
-def listen(address, port, community, mibs):
+@_v3_options
+@click.option(
+    "-e",
+    "--engine-id",
+    "engine_ids",
+    multiple=True,
+    help="Hex engine ID of an SNMPv3 agent sending traps.  Use multiple times to add multiple agents.",
+)
+@_format_option
+def listen(
+    address,
+    port,
+    community,
+    mibs,
+    user,
+    auth_key,
+    auth_protocol,
+    priv_key,
+    priv_protocol,
+    key_cache,
+    engine_ids,
+    output_format,
+):
     """Listen to and SNMP trap and print events."""
-    snmp.listen(address, port, community, snmp.DEFAULT_MIBS + mibs)
+    user = _make_v3_user(user, auth_key, auth_protocol, priv_key, priv_protocol)
+    snmp.listen(
+        address,
+        port,
+        community,
+        snmp.DEFAULT_MIBS + mibs,
+        user=user,
+        engine_ids=engine_ids,
+        key_cache_path=key_cache,
+        writer=output.BufferedWriter(output_format),
+    )
+    return 0
+
+
+@snmp_group.command()
+@click.argument(
+    "files",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "-d",
+    "--database",
+    default=capture.DEFAULT_DATABASE,
+    show_default=True,
+    help="SQLAlchemy URL of the database in which to store the traps.",
+)
+@click.option(
+    "-p",
+    "--port",
+    default=snmp.DEFAULT_PORT,
+    show_default=True,
+    type=int,
+    help="Destination port of the captured traps.",
+)
+@click.option(
+    "-m",
+    "--mib",
+    "mibs",
+    multiple=True,
+    nargs=1,
+    help="Load extra SNMP MIB(s) for nicer output.  Use multiple times to add multiple MIBs.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    help="Number of decoding processes.  Defaults to the number of CPUs.",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    default=capture.DEFAULT_BATCH_SIZE,
+    show_default=True,
+    type=int,
+    help="Number of datagrams decoded and stored at a time.",
+)
+@click.option(
+    "--partitioned",
+    is_flag=True,
+    help="Store in day-partitioned tables.  PostgreSQL only.",
+)
+def decode(files, database, port, mibs, workers, batch_size, partitioned):
+    """Decode SNMP traps from pcap files into a database."""
+    capture.decode(
+        files,
+        database,
+        port,
+        snmp.DEFAULT_MIBS + mibs,
+        workers=workers,
+        batch_size=batch_size,
+        partitioned=partitioned,
+    )
+    return 0
+
+
+@snmp_group.command("set")
+@click.option(
+    "-d",
+    "--device",
+    "addresses",
+    multiple=True,
+    required=True,
+    help="IP address of a device to set.  Use multiple times to set multiple devices.",
+)
+@click.option(
+    "-c",
+    "--community",
+    default=control.DEFAULT_COMMUNITY,
+    show_default=True,
+    help="SNMP v1/v2 read-write community.",
+)
+@click.option(
+    "-p", "--port", default=161, show_default=True, type=int, help="Agent port."
+)
+@_v3_options
+@_format_option
+@click.argument("settings", nargs=-1, required=True)
+def set_command(
+    addresses,
+    community,
+    port,
+    user,
+    auth_key,
+    auth_protocol,
+    priv_key,
+    priv_protocol,
+    key_cache,
+    output_format,
+    settings,
+):
+    """Set values, e.g. relay1=1 relay2PulseTimer=1.5, on devices and read them back.
+
+    Settings are [MODULE::]name[.index]=value, the module defaults to
+    XYTRONIX-MIB and the index to 0.  All settings of a device are written in one
+    request, and all devices are set at the same time.
+    """
+    try:
+        settings = [
+            control.make_setting(*control.parse_setting(setting))
+            for setting in settings
+        ]
+    except ValueError as exception:
+        raise click.BadParameter(str(exception), param_hint="SETTINGS")
+    user = _make_v3_user(user, auth_key, auth_protocol, priv_key, priv_protocol)
+    writer = output.BufferedWriter(output_format)
+    confirmed = control.set_relays(
+        addresses, settings, community, port, user, usm.KeyCache(key_cache), writer
+    )
+    writer.close()
+    if not confirmed:
+        sys.exit(1)
+    return 0
+
+
+@snmp_group.command("discover")
+@click.option(
+    "-c",
+    "--community",
+    default=discover.DEFAULT_COMMUNITY,
+    show_default=True,
+    help="SNMP v1/v2 community.",
+)
+@click.option(
+    "-p", "--port", default=161, show_default=True, type=int, help="Agent port."
+)
+@click.option(
+    "-t",
+    "--timeout",
+    default=discover.DEFAULT_TIMEOUT,
+    show_default=True,
+    type=float,
+    help="Seconds to wait for an answer.  Requests are not retried.",
+)
+@click.option(
+    "-n",
+    "--max-in-flight",
+    default=discover.DEFAULT_MAX_IN_FLIGHT,
+    show_default=True,
+    type=int,
+    help="Number of addresses probed at the same time.",
+)
+@click.option(
+    "-o",
+    "--output",
+    "path",
+    default=discover.DEFAULT_INVENTORY,
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="Inventory file to write.",
+)
+@click.option(
+    "--all",
+    "all_agents",
+    is_flag=True,
+    help="Put every agent in the inventory, not just X-410s.",
+)
+@_v3_options
+@click.argument("networks", nargs=-1, required=True)
+def discover_command(
+    community,
+    port,
+    timeout,
+    max_in_flight,
+    path,
+    all_agents,
+    user,
+    auth_key,
+    auth_protocol,
+    priv_key,
+    priv_protocol,
+    key_cache,
+    networks,
+):
+    """Find the X-410s in networks, e.g. 192.168.0.0/16, and write an inventory.
+
+    Every address gets a GET of sysObjectID and sysDescr; X-410s are told apart
+    by their XYTRONIX sysObjectID.  The inventory is a serve configuration file
+    with just the devices, to serve as is, pull into another one with its
+    "inventory" key, or read with temperature -i.
+    """
+    for network in networks:
+        try:
+            ipaddress.ip_network(network, strict=False)
+        except ValueError as exception:
+            raise click.BadParameter(str(exception), param_hint="NETWORKS")
+    user = _make_v3_user(user, auth_key, auth_protocol, priv_key, priv_protocol)
+    discover.discover(
+        networks,
+        community,
+        port,
+        user,
+        usm.KeyCache(key_cache),
+        timeout,
+        max_in_flight,
+        path,
+        x410_only=not all_agents,
+    )
+    return 0
+
+
+@snmp_group.command("serve")
+@click.option(
+    "-c",
+    "--config",
+    "config_path",
+    default=serve.DEFAULT_CONFIG,
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON configuration file of the listener, devices to poll and rules.",
+)
+@click.option(
+    "--key-cache",
+    default=usm.DEFAULT_KEY_CACHE,
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="File in which to cache SNMPv3 keys derived from pass phrases.",
+)
+@_format_option
+def serve_command(config_path, key_cache, output_format):
+    """Run the trap listener and pollers until interrupted.  SIGHUP reloads."""
+    serve.serve(config_path, output.BufferedWriter(output_format), key_cache)
     return 0
 
 
@@ -148,51 +499,158 @@ def db_group():
     pass
 
 
+def _compress_option(function):
+    """Decorator adding the compressed storage option to a command."""
+    return click.option(
+        "-z",
+        "--compress",
+        "compressed",
+        is_flag=True,
+        help="Store the document zlib compressed, in the compressed_words table.",
+    )(function)
+
+
 @db_group.command()
+@_compress_option
 @click.argument(
     "text",
     nargs=-1,
 )
-def sqlite(text):
+def sqlite(compressed, text):
     """Add the text as an XML document to an sqlite3 database."""
     text = " ".join(text) if text else 'We are the knights who say "NI"!'
-    db.sqlite(text)
+    db.sqlite(text, compressed)
     return 0
 
 
 @db_group.command()
+@_compress_option
 @click.argument(
     "text",
     nargs=-1,
 )
-def litealchemy(text):
+def litealchemy(compressed, text):
     """Add the text as an XML document to an sqlite3 database."""
     text = " ".join(text) if text else 'We are the knights who say "NI"!'
-    db.litealchemy(text)
+    db.litealchemy(text, compressed)
     return 0
 
 
 @db_group.command()
+@_compress_option
 @click.argument(
     "text",
     nargs=-1,
 )
-def ormlite(text):
+def ormlite(compressed, text):
     """Add the text as an XML document to an sqlite3 database."""
     text = " ".join(text) if text else 'We are the knights who say "NI"!'
-    db.ormlite(text)
+    db.ormlite(text, compressed)
     return 0
 
 
 @db_group.command()
+@_compress_option
 @click.argument(
     "text",
     nargs=-1,
 )
-def pgorm(text):
+def pgorm(compressed, text):
     """Add the text as an XML document to a PostgreSQL database."""
     text = " ".join(text) if text else 'We are the knights who say "NI"!'
-    db.pgorm(text)
+    db.pgorm(text, compressed)
+    return 0
+
+
+@db_group.command()
+@click.option(
+    "-n",
+    "--count",
+    default=10_000,
+    show_default=True,
+    type=int,
+    help="Number of documents to store each way.",
+)
+@click.option(
+    "-w",
+    "--words",
+    default=50,
+    show_default=True,
+    type=int,
+    help="Number of words per document.",
+)
+def zbench(count, words):
+    """Compare the size and speed of plain and compressed XML documents."""
+    compress.benchmark(count, words)
+    return 0
+
+
+@db_group.command()
+@click.option(
+    "-d",
+    "--database",
+    type=click.Choice(sorted(db.DATABASES)),
+    default="sqlite",
+    show_default=True,
+    help="Database of which experiment to search.",
+)
+@click.argument("words", nargs=-1, required=True)
+def search(database, words):
+    """Find the stored XML documents containing all the words."""
+    db.search(words, database)
+    return 0
+
+
+@db_group.command()
+@click.option(
+    "-d",
+    "--database",
+    default=pgstore.DEFAULT_DATABASE,
+    show_default=True,
+    help="SQLAlchemy URL of the PostgreSQL database.",
+)
+@click.option(
+    "-n",
+    "--count",
+    default=100_000,
+    show_default=True,
+    type=int,
+    help="Number of rows to write each way.",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    default=pgstore.DEFAULT_BATCH_SIZE,
+    show_default=True,
+    type=int,
+    help="Number of rows written at a time.",
+)
+def pgbench(database, count, batch_size):
+    """Compare storing traps through the ORM with COPY into partitions."""
+    pgstore.benchmark(database, count, batch_size)
+    return 0
+
+
+@db_group.command()
+@click.option(
+    "-d",
+    "--database",
+    default=pgstore.DEFAULT_DATABASE,
+    show_default=True,
+    help="SQLAlchemy URL of the PostgreSQL database.",
+)
+@click.option(
+    "-k",
+    "--keep",
+    default=pgstore.DEFAULT_RETENTION_DAYS,
+    show_default=True,
+    type=int,
+    help="Number of days of traps to keep, besides today.",
+)
+def pgretain(database, keep):
+    """Drop the partitions of stored traps older than some days."""
+    for name in pgstore.PartitionedStore(database).retain(keep):
+        print(f"Dropped {name}")
     return 0
 
 
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Last known value cache with single-flight SNMP GETs."""
+
+import asyncio
+import time
+
+DEFAULT_TTL = 1.0  # Seconds a value is served from the cache.
+
+
+class FetchError(Exception):
+    """Fetching values from a device failed (timeout, SNMP error status...)."""
+
+
+class ValueCache:
+    """Read-through cache of the last known value of each (device, OID).
+
+    Values expire after a per-OID time to live, set for whole subtrees with
+    set_ttl().  Concurrent get()s for the same (device, OID) share a single
+    in-flight request rather than each asking the device, and values seen in
+    traps or polls can be fed in with update() to keep the cache warm.
+
+    OIDs are tuples of ints.  Values are whatever fetch returns, normally
+    native values as in snmp.Results.
+
+    """
+
+    def __init__(self, default_ttl=DEFAULT_TTL):
+        self.default_ttl = default_ttl
+        self._ttls = {}  # OID prefix -> seconds.
+        self._ttl_lookups = {}  # OID -> seconds, see ttl().
+        self._values = {}  # (device, OID) -> (value, expiry time).
+        self._in_flight = {}  # (device, OID) -> Future.
+
+    def set_ttl(self, oid_prefix, ttl):
+        """Sets the time to live of all OIDs under (and including) the prefix."""
+        self._ttls[tuple(oid_prefix)] = ttl
+        self._ttl_lookups.clear()
+
+    def clear_ttls(self):
+        """Forgets all set_ttl()s, every OID gets default_ttl again."""
+        self._ttls.clear()
+        self._ttl_lookups.clear()
+
+    def ttl(self, oid):
+        """Returns the time to live of the OID, from its longest matching prefix."""
+        try:
+            return self._ttl_lookups[oid]
+        except KeyError:
+            pass
+        ttl = next(
+            (
+                self._ttls[oid[:length]]
+                for length in range(len(oid), 0, -1)
+                if oid[:length] in self._ttls
+            ),
+            self.default_ttl,
+        )
+        self._ttl_lookups[oid] = ttl
+        return ttl
+
+    def update(self, device, oid, value, now=None):
+        """Stores a freshly seen value."""
+        now = time.monotonic() if now is None else now
+        self._values[(device, oid)] = (value, now + self.ttl(oid))
+
+    async def get(self, device, oids, fetch):
+        """Returns a dict of OID -> value for the device.
+
+        Fresh values come from the cache.  The rest are fetched with a single
+        call of the coroutine function fetch(oids), which must return a dict
+        of OID -> value or raise FetchError, unless another get() is already
+        fetching them, in which case its result is shared.
+
+        """
+        now = time.monotonic()
+        values = {}
+        waiting = {}
+        missing = []
+        for oid in dict.fromkeys(oids):  # Each OID once, in order.
+            key = (device, oid)
+            cached = self._values.get(key)
+            if cached is not None and cached[1] > now:
+                values[oid] = cached[0]
+            elif key in self._in_flight:
+                waiting[oid] = self._in_flight[key]
+            else:
+                missing.append(oid)
+        if missing:
+            loop = asyncio.get_event_loop()
+            futures = {oid: loop.create_future() for oid in missing}
+            for oid, future in futures.items():
+                self._in_flight[(device, oid)] = future
+            waiting.update(futures)
+            try:
+                fetched = await fetch(missing)
+            except asyncio.CancelledError:
+                for future in futures.values():
+                    future.cancel()
+                raise
+            except Exception as exception:
+                for future in futures.values():
+                    future.set_exception(exception)
+            else:
+                now = time.monotonic()
+                for oid, future in futures.items():
+                    value = fetched.get(oid)
+                    self.update(device, oid, value, now)
+                    future.set_result(value)
+            finally:
+                for oid in missing:
+                    self._in_flight.pop((device, oid), None)
+        # Retrieves every future's exception, not just the first one raised.
+        results = await asyncio.gather(*waiting.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        values.update(zip(waiting, results))
+        return values
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""Packet Capture Experiments."""
+
+import collections
+import concurrent.futures
+import functools
+import ipaddress
+import itertools
+import os
+import struct
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from pyasn1.codec.ber import decoder
+from pyasn1.error import PyAsn1Error
+from pysnmp.proto import api
+from pysnmp.smi import error, rfc1902
+
+from . import db, pgstore, snmp
+
+DEFAULT_DATABASE = "sqlite:///traps.db"
+DEFAULT_BATCH_SIZE = 1000
+
+# Magic number -> (struct byte order, timestamp fraction resolution).
+_PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+_LINKTYPE_ETHERNET = 1
+_LINKTYPE_RAW = 101
+_LINKTYPE_LINUX_SLL = 113
+_ETHERTYPE_VLAN = (b"\x81\x00", b"\x88\xa8")
+_IPPROTO_UDP = 17
+
+_SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)  # SNMPv2-MIB::snmpTrapOID.0
+_SNMP_TRAPS = (1, 3, 6, 1, 6, 3, 1, 1, 5)  # SNMPv2-MIB::snmpTraps
+
+
+def _udp_payload(frame, link_type, port):
+    """Returns (source address, payload) of a UDP datagram sent to port.
+
+    Returns None for anything else, including fragmented IPv4 packets and
+    frames cut short by the capture's snaplen.
+
+    """
+    if link_type == _LINKTYPE_ETHERNET:
+        offset = 12
+        while frame[offset : offset + 2] in _ETHERTYPE_VLAN:
+            offset += 4
+        offset += 2
+    elif link_type == _LINKTYPE_LINUX_SLL:
+        offset = 16
+    elif link_type == _LINKTYPE_RAW:
+        offset = 0
+    else:
+        raise ValueError(f"Unsupported pcap link type {link_type}.")
+    if len(frame) <= offset:
+        return None
+    ip_version = frame[offset] >> 4
+    if ip_version == 4:
+        header_length = (frame[offset] & 0x0F) * 4
+        if header_length < 20 or len(frame) < offset + header_length:
+            return None
+        flags_fragment = struct.unpack_from("!H", frame, offset + 6)[0]
+        if frame[offset + 9] != _IPPROTO_UDP or flags_fragment & 0x3FFF:
+            return None
+        source = frame[offset + 12 : offset + 16]
+        offset += header_length
+    elif ip_version == 6:
+        # Extension headers are not followed.  Traps don't use them in practice.
+        if len(frame) < offset + 40 or frame[offset + 6] != _IPPROTO_UDP:
+            return None
+        source = frame[offset + 8 : offset + 24]
+        offset += 40
+    else:
+        return None
+    if len(frame) < offset + 8:
+        return None
+    _, destination_port, length = struct.unpack_from("!HHH", frame, offset)
+    if destination_port != port or length < 8 or len(frame) < offset + length:
+        return None
+    return str(ipaddress.ip_address(source)), frame[offset + 8 : offset + length]
+
+
+def _read_pcap(path, port=snmp.DEFAULT_PORT):
+    """Yields (timestamp, source address, payload) for each datagram sent to port.
+
+    Supports classic libpcap files only, not pcapng.
+
+    """
+    with open(path, "rb") as pcap_file:
+        header = pcap_file.read(24)
+        try:
+            byte_order, resolution = _PCAP_MAGIC[header[:4]]
+        except KeyError:
+            raise ValueError(f"{path} is not a pcap file.") from None
+        link_type = struct.unpack(byte_order + "I", header[20:24])[0] & 0x0FFFFFFF
+        record_header = struct.Struct(byte_order + "IIII")
+        while True:
+            raw_header = pcap_file.read(record_header.size)
+            if len(raw_header) < record_header.size:
+                break
+            seconds, fraction, length, _ = record_header.unpack(raw_header)
+            datagram = _udp_payload(pcap_file.read(length), link_type, port)
+            if datagram:
+                yield (seconds + fraction * resolution,) + datagram
+
+
+def _batched(iterable, size):
+    """Yields lists of up to size items from the iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _map_bounded(executor, function, iterable, limit):
+    """Like executor.map(), but keeps at most limit tasks in flight.
+
+    executor.map() consumes the whole iterable up front, which would read
+    entire capture files into memory.  Results are yielded in order.
+
+    """
+    pending = collections.deque()
+    for item in iterable:
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def _init_worker(mibs, mib_dirs):
+    """Process pool initializer.  Loads the MIBs once per worker process."""
+    snmp._view_controller = snmp._make_view_controller(mibs, mib_dirs)
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve(oid):
+    """Returns the MIB name for a dotted OID string, or the OID if unknown."""
+    name = rfc1902.ObjectIdentity(oid)
+    try:
+        name.resolveWithMib(snmp._view_controller)
+    except error.SmiError:
+        return oid
+    return name.prettyPrint()
+
+
+def _decode_notification(payload):
+    """Decodes an SNMP v1/v2c notification datagram.
+
+    Returns (notification OID, var_binds), or None if it is not a notification.
+    SNMPv3 messages can not be decoded without the USM keys and are skipped.
+
+    """
+    msg_version = int(api.decodeMessageVersion(payload))
+    if msg_version not in api.protoModules:
+        return None
+    p_mod = api.protoModules[msg_version]
+    msg, _ = decoder.decode(payload, asn1Spec=p_mod.Message())
+    pdu = p_mod.apiMessage.getPDU(msg)
+    if msg_version == api.protoVersion1:
+        if not pdu.isSameTypeWith(p_mod.TrapPDU()):
+            return None
+        # RFC 2576 section 3.1, v1 trap to v2 notification OID.
+        generic = int(p_mod.apiTrapPDU.getGenericTrap(pdu))
+        if generic == 6:
+            enterprise = tuple(p_mod.apiTrapPDU.getEnterprise(pdu))
+            specific = int(p_mod.apiTrapPDU.getSpecificTrap(pdu))
+            notification = enterprise + (0, specific)
+        else:
+            notification = _SNMP_TRAPS + (generic + 1,)
+        return notification, p_mod.apiTrapPDU.getVarBinds(pdu)
+    if not (
+        pdu.isSameTypeWith(p_mod.TrapPDU())
+        or pdu.isSameTypeWith(p_mod.InformRequestPDU())
+    ):
+        return None
+    var_binds = p_mod.apiPDU.getVarBinds(pdu)
+    notification = next(
+        (tuple(value) for oid, value in var_binds if tuple(oid) == _SNMP_TRAP_OID),
+        (),
+    )
+    return notification, var_binds
+
+
+def _decode_batch(batch):
+    """Decodes a batch of (timestamp, source, payload) datagrams.
+
+    Runs in a worker process.  Returns (rows, number of undecodable datagrams),
+    where rows are plain dicts ready for db._bulk_insert() into db.Traps.
+    A notification without var binds gets one row with an empty oid.
+
+    """
+    rows = []
+    errors = 0
+    for timestamp, source, payload in batch:
+        try:
+            decoded = _decode_notification(payload)
+        except PyAsn1Error:
+            errors += 1
+            continue
+        if decoded is None:
+            continue
+        notification, var_binds = decoded
+        notification = ".".join(str(part) for part in notification)
+        notification = _resolve(notification) if notification else ""
+        timestamp = datetime.fromtimestamp(timestamp, timezone.utc)
+        if not var_binds:
+            # E.g. a v1 coldStart.  Still worth a row, with no OID or value.
+            rows.append(
+                dict(
+                    timestamp=timestamp,
+                    source=source,
+                    notification=notification,
+                    oid="",
+                    name=None,
+                    value=None,
+                )
+            )
+        for oid, value in var_binds:
+            oid = oid.prettyPrint()
+            rows.append(
+                dict(
+                    timestamp=timestamp,
+                    source=source,
+                    notification=notification,
+                    oid=oid,
+                    name=_resolve(oid),
+                    value=value.prettyPrint(),
+                )
+            )
+    return rows, errors
+
+
+def decode(
+    paths,
+    database=DEFAULT_DATABASE,
+    port=snmp.DEFAULT_PORT,
+    mibs=snmp.DEFAULT_MIBS,
+    mib_dirs=snmp.DEFAULT_MIB_DIRS,
+    workers=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    partitioned=False,
+):
+    """Decode SNMP traps from pcap files and store them in a database.
+
+    Datagrams are decoded in batches across a pool of processes.  If
+    partitioned, the database must be PostgreSQL and the traps go into a
+    pgstore.PartitionedStore instead of db.Traps.
+
+    """
+    if partitioned:
+        store = pgstore.PartitionedStore(database)
+        store.create()
+        write = store.write
+    else:
+        engine = sa.create_engine(database)
+        db.Base.metadata.create_all(engine, tables=[db.Traps.__table__])
+        write = functools.partial(db._bulk_insert, engine, db.Traps.__table__)
+    datagrams = itertools.chain.from_iterable(_read_pcap(path, port) for path in paths)
+    workers = workers or os.cpu_count() or 1
+    total_rows = total_errors = 0
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(mibs, mib_dirs)
+    ) as executor:
+        # Two batches per worker keeps them busy while the main process inserts.
+        batches = _batched(datagrams, batch_size)
+        for rows, errors in _map_bounded(executor, _decode_batch, batches, 2 * workers):
+            total_rows += write(rows)
+            total_errors += errors
+    if partitioned:
+        total_rows += store.flush()
+    print(f"Stored {total_rows} values in {database}")
+    if total_errors:
+        print(f"WARNING: {total_errors} datagrams could not be decoded.")
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Compressed storage of XML documents with a shared zlib dictionary."""
+
+import collections
+import re
+import sqlite3
+import time
+import zlib
+
+import sqlalchemy as sa
+
+from . import xml
+
+DICTIONARY_SIZE = 32 * 1024  # zlib only looks back this far anyway.
+LEVEL = 9
+SQLITE_TYPE = "XMLZ"  # Declared column type picked up by the sqlite3 converter.
+
+_FRAGMENTS = re.compile(r"<[^>]*>|[^<]+")
+_HEADER = 4  # Bytes of dictionary checksum in front of each document.
+_default_codec = None
+
+# The dictionary for xml._words() documents.  Trained with train_dictionary()
+# on a dozen of them; it is the markup around the words that repeats.  Never
+# change it, documents stored with it can only be read back with it.
+DEFAULT_DICTIONARY = (
+    b'relaythere,Hello"NI"!saywhoknightstheareWe<word></word>'
+    b'<words myattribute="So many pretty words!"><timestamp><root></words>'
+    b"</timestamp></root><!DOCTYPE xml>"
+)
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """Returns a zlib preset dictionary made from sample documents.
+
+    The samples are cut into tags and text between tags, and the fragments
+    seen in most samples go in, up to size bytes.  The most common go last,
+    where zlib finds them with the shortest distances.
+
+    """
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update(set(_FRAGMENTS.findall(sample)))
+    fragments = []
+    length = 0
+    # Ties are broken by the fragment itself, the same samples must always
+    # give the same dictionary.
+    for fragment, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+        if count < 2 and fragments:
+            break
+        if length + len(fragment.encode("utf-8")) > size:
+            continue
+        fragments.append(fragment)
+        length += len(fragment.encode("utf-8"))
+    return "".join(reversed(fragments)).encode("utf-8")
+
+
+class Codec:
+    """Compresses text with zlib and a preset dictionary.
+
+    Each compressed document starts with the dictionary's checksum, so it is
+    not silently decompressed with the wrong dictionary.
+
+    """
+
+    def __init__(self, dictionary=b"", level=LEVEL):
+        self.dictionary = dictionary
+        self.level = level
+        self.checksum = zlib.adler32(dictionary).to_bytes(_HEADER, "big")
+
+    def compress(self, text):
+        compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        data = compressor.compress(text.encode("utf-8")) + compressor.flush()
+        return self.checksum + data
+
+    def decompress(self, data):
+        if bytes(data[:_HEADER]) != self.checksum:
+            raise ValueError("Document compressed with a different dictionary.")
+        decompressor = zlib.decompressobj(zdict=self.dictionary)
+        data = decompressor.decompress(data[_HEADER:]) + decompressor.flush()
+        return data.decode("utf-8")
+
+
+def default_codec():
+    """Returns the Codec with the DEFAULT_DICTIONARY."""
+    global _default_codec
+    if _default_codec is None:
+        _default_codec = Codec(DEFAULT_DICTIONARY)
+    return _default_codec
+
+
+class LazyText:
+    """A compressed document, decompressed the first time its text is needed."""
+
+    __slots__ = ("data", "codec", "_text")
+
+    def __init__(self, data, codec=None):
+        self.data = bytes(data)
+        self.codec = codec or default_codec()
+        self._text = None
+
+    @classmethod
+    def from_text(cls, text, codec=None):
+        codec = codec or default_codec()
+        lazy_text = cls(codec.compress(text), codec)
+        lazy_text._text = text
+        return lazy_text
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.codec.decompress(self.data)
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return repr(self.text)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyText):
+            return self.text == other.text
+        return self.text == other
+
+    def __hash__(self):
+        return hash(self.text)
+
+
+class CompressedXML(sa.TypeDecorator):
+    """Column type storing text compressed, loaded as LazyText.
+
+    Takes str or LazyText values; LazyText loaded from the database is stored
+    again without recompressing it.
+
+    """
+
+    impl = sa.LargeBinary
+
+    def __init__(self, codec=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = codec
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, LazyText):
+            value = LazyText.from_text(value, self.codec)
+        return value.data
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return LazyText(value, self.codec)
+
+
+def register_sqlite(codec=None):
+    """Lets sqlite3 store LazyText and load SQLITE_TYPE columns as LazyText.
+
+    The connection must be made with detect_types=sqlite3.PARSE_DECLTYPES.
+
+    """
+    sqlite3.register_adapter(LazyText, lambda value: value.data)
+    sqlite3.register_converter(SQLITE_TYPE, lambda data: LazyText(data, codec))
+
+
+def benchmark(count=10_000, words=50):
+    """Prints the size and speed of storing xml._words() documents compressed.
+
+    Compares plain TEXT with zlib, with and without the default dictionary,
+    in an in-memory sqlite3 database.
+
+    """
+    vocabulary = 'We are the knights who say "NI"! relay1 relay2 temp 42'.split()
+    documents = [
+        xml._words([vocabulary[(i * 7 + j) % len(vocabulary)] for j in range(words)])
+        for i in range(count)
+    ]
+    print(f"{count} documents of {words} words:")
+    for name, codec in (
+        ("plain", None),
+        ("zlib", Codec()),
+        ("zlib + dictionary", default_codec()),
+    ):
+        register_sqlite(codec)
+        conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+        column_type = "TEXT" if codec is None else SQLITE_TYPE
+        conn.execute(f"CREATE TABLE words (id INTEGER PRIMARY KEY, xml {column_type})")
+        start = time.perf_counter()
+        if codec is not None:
+            documents_in = (LazyText.from_text(doc, codec) for doc in documents)
+        else:
+            documents_in = documents
+        with conn:
+            conn.executemany(
+                "INSERT INTO words (xml) VALUES (?)", ((doc,) for doc in documents_in)
+            )
+        write_time = time.perf_counter() - start
+        (size,) = conn.execute("SELECT SUM(LENGTH(xml)) FROM words").fetchone()
+        start = time.perf_counter()
+        # Reading the text forces the lazy decompression.
+        for (document,) in conn.execute("SELECT xml FROM words"):
+            str(document)
+        read_time = time.perf_counter() - start
+        conn.close()
+        print(
+            f"{name:18} {size / count:7.0f} bytes/document "
+            f"write {count / write_time:8.0f}/s read {count / read_time:8.0f}/s"
+        )
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""SNMP SETs, e.g. to switch the relays of many X-410 modules at once."""
+
+import asyncio
+import collections
+import re
+import sys
+
+from pysnmp.hlapi import asyncio as hlapi_asyncio
+from pysnmp.smi import error
+
+from . import health, snmp
+
+DEFAULT_COMMUNITY = "webrelay"  # The X-410's default read-write community.
+DEFAULT_MODULE = "XYTRONIX-MIB"  # For settings given as just a name.
+DEFAULT_MAX_IN_FLIGHT = 64  # Devices being set at the same time.
+
+DeviceResult = collections.namedtuple(
+    "DeviceResult", "address results mismatches set_time check_time"
+)
+DeviceResult.__doc__ = """Outcome of setting one device.
+
+results are the snmp.Results of the read-back, or of the SET if that failed.
+mismatches are (OID, expected value) pairs that did not read back as written.
+set_time and check_time are the SET and read-back round trips in seconds, or
+None if the request was not made.  The settings are confirmed if the read-back
+has neither errors nor mismatches, see confirmed().
+"""
+
+
+def parse_setting(text):
+    """Returns (module, name, index...) and value from "[MODULE::]name[.index]=value".
+
+    The module defaults to XYTRONIX-MIB and the index to 0, so "relay1=1" turns
+    relay 1 on.  X-410 relays take "0" (off), "1" (on) or "2" (pulse), and
+    relayNPulseTimer the pulse duration in seconds.
+
+    """
+    identity, separator, value = text.partition("=")
+    if not separator:
+        raise ValueError(f"Expected name=value, got {text!r}.")
+    module, _, name = identity.strip().rpartition("::")
+    name, *index = name.split(".")
+    return (module or DEFAULT_MODULE, name) + tuple(
+        int(part) for part in index or ["0"]
+    ), value
+
+
+def make_setting(id_parts, value):
+    """Returns a resolved ObjectType setting the object to the value.
+
+    The value (normally a string) is cast to the object's syntax from the MIB.
+    Like snmp._make_object(), names are turned into OIDs through the symbol
+    index rather than a symbolic MIB lookup.  Raises ValueError for unknown
+    objects and values the syntax does not take.
+
+    """
+    symbol = snmp._get_symbol_index().get(tuple(id_parts[:2]))
+    if symbol is None:
+        raise ValueError(f"Unknown object {'::'.join(map(str, id_parts[:2]))}.")
+    oid, syntax = symbol
+    if syntax is None:
+        raise ValueError(f"{'::'.join(id_parts[:2])} has no value to set.")
+    object_type = hlapi_asyncio.ObjectType(
+        hlapi_asyncio.ObjectIdentity(oid + tuple(id_parts[2:])), value
+    )
+    try:
+        object_type.resolveWithMib(snmp._get_view_controller())
+    except error.SmiError as exception:
+        raise ValueError(str(exception).partition("caused by")[0]) from exception
+    return object_type
+
+
+def _read_back_matches(oid, expected, value):
+    """Returns whether the value read back agrees with the one written to oid.
+
+    X-410 relays are DisplayStrings: one pulsed with "2" reads back as "0" or
+    "1", and pulse timers are compared as numbers, so "1.50" matches "1.5".
+
+    """
+    module, _, name = snmp._describe(oid)[1].partition("::")
+    name = name.split(".")[0]
+    if module == DEFAULT_MODULE and re.fullmatch(r"relay\d+", name):
+        if expected == "2":
+            return value in ("0", "1")
+    elif module == DEFAULT_MODULE and re.fullmatch(r"relay\d+PulseTimer", name):
+        try:
+            return float(value) == float(expected)
+        except (TypeError, ValueError):
+            return False
+    return value == expected
+
+
+async def _request(command, snmp_engine, auth_data, target, var_binds, device):
+    """Sends one SNMP request and returns its result and round trip time."""
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    result = await command(
+        snmp_engine,
+        auth_data,
+        target,
+        hlapi_asyncio.ContextData(),
+        *var_binds,
+        lookupMib=False,
+    )
+    elapsed = loop.time() - start
+    snmp._record_health(device, result[0], elapsed, target.timeout)
+    return result, elapsed
+
+
+async def set_device(snmp_engine, auth_data, address, settings, port=161):
+    """Sets all the settings on one device, then reads them back.
+
+    All settings go in a single SET PDU, so they are applied together, and are
+    checked with a single GET.  Returns a DeviceResult.
+
+    """
+    device = health.get(address, port)
+    results = snmp.Results()
+    if not device.allow():
+        results.add(f"{address}:{port} is down, request skipped", 0, 0, [])
+        return DeviceResult(address, results, [], None, None)
+    target = hlapi_asyncio.UdpTransportTarget(
+        (address, port), timeout=device.timeout(), retries=health.RETRIES
+    )
+    result, set_time = await _request(
+        hlapi_asyncio.setCmd, snmp_engine, auth_data, target, settings, device
+    )
+    results.add(*result)
+    if results.errors:
+        return DeviceResult(address, results, [], set_time, None)
+    # Agents answer a SET with the values requested, not the values they ended
+    # up with, hence the read-back.
+    objects = [
+        hlapi_asyncio.ObjectType(setting[0]) for setting in settings  # No values.
+    ]
+    result, check_time = await _request(
+        hlapi_asyncio.getCmd, snmp_engine, auth_data, target, objects, device
+    )
+    results = snmp.Results()
+    results.add(*result)
+    expected = {
+        tuple(setting[0].getOid()): snmp._native(setting[1]) for setting in settings
+    }
+    mismatches = [
+        (oid, expected[oid])
+        for oid, value in zip(results.oids, results.values)
+        if oid in expected and not _read_back_matches(oid, expected[oid], value)
+    ]
+    return DeviceResult(address, results, mismatches, set_time, check_time)
+
+
+async def set_devices(
+    snmp_engine,
+    auth_data,
+    addresses,
+    settings,
+    port=161,
+    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+):
+    """Applies the settings to all devices concurrently.
+
+    Returns DeviceResults in the order of the addresses.  At most max_in_flight
+    devices are worked on at a time.
+
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def set_one(address):
+        async with semaphore:
+            return await set_device(snmp_engine, auth_data, address, settings, port)
+
+    return await asyncio.gather(*(set_one(address) for address in addresses))
+
+
+def confirmed(result):
+    """Returns whether the DeviceResult's settings read back as written."""
+    return (
+        result.check_time is not None
+        and not result.results.errors
+        and not result.mismatches
+    )
+
+
+def set_values(
+    addresses,
+    settings,
+    community=DEFAULT_COMMUNITY,
+    port=161,
+    user=None,
+    key_cache=None,
+    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+):
+    """Sets the settings (from make_setting()) on every device.
+
+    Uses one asyncio SNMP engine for all devices, sharing the loaded MIB view
+    like snmp._make_get().  Returns a list of DeviceResults.
+
+    """
+    snmp_engine = hlapi_asyncio.SnmpEngine()
+    snmp_engine.setUserContext(mibViewController=snmp._get_view_controller())
+    auth_data = snmp._make_auth_data(community, user=user, key_cache=key_cache)
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(
+        set_devices(snmp_engine, auth_data, addresses, settings, port, max_in_flight)
+    )
+
+
+def _describe_result(result):
+    """Returns a one line summary of a DeviceResult."""
+    if result.set_time is None:
+        state = "not set"
+    elif result.check_time is None:
+        state = f"set failed after {result.set_time * 1000:.1f} ms"
+    elif result.results.errors:
+        state = (
+            f"set, but read back failed after "
+            f"{(result.set_time + result.check_time) * 1000:.1f} ms"
+        )
+    else:
+        state = (
+            f"{'mismatch' if result.mismatches else 'confirmed'} in "
+            f"{(result.set_time + result.check_time) * 1000:.1f} ms "
+            f"(set {result.set_time * 1000:.1f} ms, "
+            f"read back {result.check_time * 1000:.1f} ms)"
+        )
+    lines = [f"{result.address}: {state}"]
+    lines.extend(
+        f"    {snmp._describe(oid)[1]} is not {snmp._format_value(value)}"
+        for oid, value in result.mismatches
+    )
+    return "\n".join(lines)
+
+
+def set_relays(
+    addresses,
+    settings,
+    community=DEFAULT_COMMUNITY,
+    port=161,
+    user=None,
+    key_cache=None,
+    writer=None,
+):
+    """Sets relays (or anything else) on the devices and prints the outcome.
+
+    The read-back values go through the output.BufferedWriter, if given, and
+    are followed by a summary line per device with its latency.  With structured
+    formats the summary goes to stderr instead of stdout.  Returns whether every
+    device confirmed every setting.
+
+    """
+    results = set_values(addresses, settings, community, port, user, key_cache)
+    status = sys.stdout
+    for result in results:
+        if writer is None:
+            snmp._print_results(result.results)
+        else:
+            writer.write_result(
+                result.results.errors, result.results.var_binds(), result.address
+            )
+    if writer is not None:
+        writer.flush()
+        if writer.format != "text":
+            status = sys.stderr
+    for result in results:
+        print(_describe_result(result), file=status)
+    return all(confirmed(result) for result in results)
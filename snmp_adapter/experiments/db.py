@@ -4,12 +4,13 @@
 
 
 import sqlite3
+import string
 import sqlalchemy as sa
 from sqlalchemy.ext import declarative as dcl
 from sqlalchemy import orm
 from sqlalchemy import inspect
 
-from . import xml
+from . import compress, xml
 
 
 # Added type hint to make mypy happy.
@@ -63,12 +64,129 @@ class Words(Base, MyMixin):
         return cls(xml._words(text))
 
 
-def sqlite(text):
+class CompressedWords(Base, MyMixin):
+    """Words stored compressed, see compress.CompressedXML.
+
+    Word indexed in CompressedWordIndex, as the ids overlap with those of Words.
+
+    """
+
+    __tablename__ = "compressed_words"
+
+    id = sa.Column(sa.Integer, primary_key=True)  # Implicit autoincrement.
+    xml = sa.Column(compress.CompressedXML(), nullable=False)
+
+    def __init__(self, xml=None):
+        self.xml = xml
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(xml._words(text))
+
+
+class WordIndex(Base, MyMixin):
+    """Inverted index of Words: one row per occurrence of a word in a document.
+
+    Lets documents be found by word without parsing every document's XML.
+    Words are indexed as from _terms().
+
+    """
+
+    __tablename__ = "word_index"
+
+    # The primary key doubles as the index on word.
+    word = sa.Column(sa.Unicode, primary_key=True)
+    doc_id = sa.Column(sa.Integer, primary_key=True)
+    position = sa.Column(sa.Integer, primary_key=True)
+
+
+class CompressedWordIndex(Base, MyMixin):
+    """Inverted index of CompressedWords, like WordIndex."""
+
+    __tablename__ = "compressed_word_index"
+
+    word = sa.Column(sa.Unicode, primary_key=True)
+    doc_id = sa.Column(sa.Integer, primary_key=True)
+    position = sa.Column(sa.Integer, primary_key=True)
+
+
+# Each document table and its word index.
+INDEXED = ((Words, WordIndex), (CompressedWords, CompressedWordIndex))
+
+
+class Traps(Base, MyMixin):
+    """One row per variable binding of a received SNMP notification."""
+
+    __tablename__ = "traps"
+
+    id = sa.Column(sa.Integer, primary_key=True)  # Implicit autoincrement.
+    timestamp = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    source = sa.Column(sa.Unicode, nullable=False)
+    notification = sa.Column(sa.Unicode, nullable=False)
+    oid = sa.Column(sa.Unicode, nullable=False)
+    name = sa.Column(sa.Unicode)
+    value = sa.Column(sa.Unicode)
+
+
+def _bulk_insert(engine, table, rows):
+    """Insert a list of row dicts into the table in one transaction.
+
+    Skips the ORM unit of work and uses a single executemany() instead.
+    Returns the number of rows inserted.
+
+    """
+    if not rows:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(table.insert(), rows)
+    return len(rows)
+
+
+def _terms(words):
+    """Returns (term, position) pairs of the words (a text or a list) to index.
+
+    Terms are case folded and stripped of surrounding punctuation, so '"NI"!'
+    is found as ni.  Positions count all words, even those without a term.
+
+    """
+    words = words.split() if isinstance(words, str) else words
+    terms = []
+    for position, word in enumerate(words):
+        term = word.strip(string.punctuation).casefold()
+        if term:
+            terms.append((term, position))
+    return terms
+
+
+def _index_rows(doc_id, words):
+    """Returns the WordIndex rows, as dicts, of one document's words."""
+    return [
+        {"word": term, "doc_id": doc_id, "position": position}
+        for term, position in _terms(words)
+    ]
+
+
+def _backfill_index(conn, words_table, index_table):
+    """Index the documents already in words_table, parsing their XML once."""
+    rows = []
+    for doc_id, xml_doc in conn.execute(
+        sa.select([words_table.c.id, words_table.c.xml])
+    ):
+        # Compressed documents are LazyText.
+        rows.extend(_index_rows(doc_id, xml._read_words(str(xml_doc))))
+    if rows:
+        conn.execute(index_table.insert(), rows)
+
+
+def sqlite(text, compressed=False):
     """Create/Append an sqlite db with the output of the xml.words().
 
     Uses sqlite3 directly.
 
     """
+    if compressed:
+        _sqlite_compressed(text)
+        return
     # sqlite3 is built-in so it makes a good first test.
     conn = sqlite3.connect("words.db")
     cur = conn.cursor()
@@ -81,71 +199,151 @@ def sqlite(text):
             """CREATE TABLE words (id INTEGER PRIMARY KEY AUTOINCREMENT, xml TEXT NOT NULL);"""
         )
         conn.commit()
+    _sqlite_index(conn, "words", "word_index")
     xml_doc = xml._words(text)
     cur.execute("""INSERT INTO words (xml) VALUES (?);""", (xml_doc,))
+    cur.executemany(
+        """INSERT INTO word_index VALUES (?, ?, ?);""",
+        ((term, cur.lastrowid, position) for term, position in _terms(text)),
+    )
     conn.commit()
     print("-" * 79)
     for row in cur.execute("""SELECT * from words;"""):
         print(row)
 
 
-def litealchemy(text):
+def _sqlite_index(conn, words_table, index_table):
+    """Creates the word index of words_table, if missing, and fills it."""
+    result = conn.execute(
+        """SELECT name FROM sqlite_master WHERE type='table' AND name=?;""",
+        (index_table,),
+    )
+    if result.fetchone():
+        return
+    with conn:
+        conn.execute(
+            f"""CREATE TABLE {index_table} (word TEXT NOT NULL, doc_id INTEGER NOT NULL, position INTEGER NOT NULL, PRIMARY KEY (word, doc_id, position)) WITHOUT ROWID;"""
+        )
+        conn.executemany(
+            f"""INSERT INTO {index_table} VALUES (?, ?, ?);""",
+            (
+                (term, doc_id, position)
+                for doc_id, xml_doc in conn.execute(
+                    f"""SELECT id, xml FROM {words_table};"""
+                )
+                for term, position in _terms(xml._read_words(str(xml_doc)))
+            ),
+        )
+
+
+def _sqlite_compressed(text):
+    """Like sqlite(), but stores the document compressed in compressed_words.
+
+    Uses the sqlite3 adapter and converter from compress.register_sqlite().
+
+    """
+    compress.register_sqlite()
+    conn = sqlite3.connect("words.db", detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS compressed_words (id INTEGER PRIMARY KEY AUTOINCREMENT, xml {compress.SQLITE_TYPE} NOT NULL);"""
+    )
+    _sqlite_index(conn, "compressed_words", "compressed_word_index")
+    xml_doc = compress.LazyText.from_text(xml._words(text))
+    with conn:
+        cur = conn.execute(
+            """INSERT INTO compressed_words (xml) VALUES (?);""", (xml_doc,)
+        )
+        conn.executemany(
+            """INSERT INTO compressed_word_index VALUES (?, ?, ?);""",
+            ((term, cur.lastrowid, position) for term, position in _terms(text)),
+        )
+    print("-" * 79)
+    for row in conn.execute("""SELECT * from compressed_words;"""):
+        print(row)
+
+
+def litealchemy(text, compressed=False):
     """Create/Append an sqlite db with the output of the xml.words().
 
-    Uses sqlalchemy expression language with sqlite3.
+    Uses sqlalchemy expression language with sqlite3.  If compressed, the
+    document goes into compressed_words instead, indexed in
+    compressed_word_index.
 
     """
     engine = sa.create_engine("sqlite:///words2.db")
     meta = sa.MetaData()
     words = sa.Table(
-        "words",
+        "compressed_words" if compressed else "words",
         meta,
         sa.Column("id", sa.Integer, primary_key=True),  # Implicit autoincrement.
-        sa.Column("xml", sa.Unicode, nullable=False),
+        sa.Column(
+            "xml",
+            compress.CompressedXML() if compressed else sa.Unicode,
+            nullable=False,
+        ),
     )
+    index_model = CompressedWordIndex if compressed else WordIndex
+    word_index = index_model.__table__.tometadata(meta)
+    new_index = word_index.name not in inspect(engine).get_table_names()
     meta.create_all(engine)  # Automatically checks for existing tables before create.
     xml_doc = xml._words(text)
     conn = engine.connect()
-    conn.execute(words.insert().values(xml=xml_doc))
+    with conn.begin():
+        if new_index:
+            _backfill_index(conn, words, word_index)
+        result = conn.execute(words.insert().values(xml=xml_doc))
+        index_rows = _index_rows(result.inserted_primary_key[0], text)
+        if index_rows:
+            conn.execute(word_index.insert(), index_rows)
     result = conn.execute(words.select())
     for row in result:
         print(row)
 
 
-def _orm_common(engine, text):
+def _orm_common(engine, text, compressed=False):
     """Create/Append to a db table with the output of the xml.words().
 
     Uses sqlalchemy ORM language.
     This is all the database-independent code.
     It does not matter what DB you use for this stuff.
+    If compressed, uses CompressedWords and CompressedWordIndex rather than
+    Words and WordIndex.
 
     """
     # I started getting quite fancy with this example.
     # The classes include lots of unnecessary, but nice, extras.
 
     # Automatically checks for existing tables before create.
+    tables = inspect(engine).get_table_names()
     Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for words_model, index_model in INDEXED:
+            if index_model.__tablename__ not in tables:
+                _backfill_index(conn, words_model.__table__, index_model.__table__)
     Session = orm.sessionmaker(bind=engine)
     session = Session()
-    words = Words.from_text(text)
+    model, index_model = INDEXED[1] if compressed else INDEXED[0]
+    words = model.from_text(text)
     session.add(words)
+    session.flush()  # Assigns words.id.
+    session.bulk_insert_mappings(index_model, _index_rows(words.id, text))
     session.commit()
-    results = session.query(Words).all()
+    results = session.query(model).all()
     for row in results:
         print(row)
 
 
-def ormlite(text):
+def ormlite(text, compressed=False):
     """Create/Append an sqlite db with the output of the xml.words().
 
     Uses sqlalchemy ORM language with sqlite3.
 
     """
     engine = sa.create_engine("sqlite:///words3.db")
-    _orm_common(engine, text)
+    _orm_common(engine, text, compressed)
 
 
-def pgorm(text):
+def pgorm(text, compressed=False):
     """Create/Append to an PostgreSQL table with the output of the xml.words().
 
     Uses sqlalchemy ORM language with PostgreSQL.
@@ -154,4 +352,46 @@ def pgorm(text):
     # Uses psycopg2 implicitly
     # Using a local unix domain connection, not TCP.  No passowrd needed. :)
     engine = sa.create_engine("postgresql://krys@/krys")
-    _orm_common(engine, text)
+    _orm_common(engine, text, compressed)
+
+
+# Databases of the experiments above, by name.
+DATABASES = {
+    "sqlite": "sqlite:///words.db",
+    "litealchemy": "sqlite:///words2.db",
+    "ormlite": "sqlite:///words3.db",
+    "pgorm": "postgresql://krys@/krys",
+}
+
+
+def search(words, database="sqlite"):
+    """Prints the documents containing all the words, found through the index.
+
+    database is one of DATABASES, all of which use the same tables.  Plain
+    documents are printed first, then compressed ones.
+
+    """
+    terms = sorted({term for term, position in _terms(words)})
+    if not terms:
+        return
+    engine = sa.create_engine(DATABASES[database])
+    tables = inspect(engine).get_table_names()
+    with engine.connect() as conn:
+        for words_model, index_model in INDEXED:
+            words_table = words_model.__table__
+            index_table = index_model.__table__
+            if index_table.name not in tables:
+                continue  # Nothing stored that way yet.
+            matches = (
+                sa.select([index_table.c.doc_id])
+                .where(index_table.c.word.in_(terms))
+                .group_by(index_table.c.doc_id)
+                .having(sa.func.count(sa.distinct(index_table.c.word)) == len(terms))
+            )
+            query = (
+                sa.select([words_table])
+                .where(words_table.c.id.in_(matches))
+                .order_by(words_table.c.id)
+            )
+            for row in conn.execute(query):
+                print(row)
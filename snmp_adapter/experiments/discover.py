@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+"""Discovery of SNMP agents, X-410 modules in particular, in whole subnets."""
+
+import asyncio
+import collections
+import ipaddress
+import json
+import os
+import sys
+
+from pysnmp.entity.rfc3413 import config
+from pysnmp.hlapi import asyncio as hlapi_asyncio
+from pysnmp.hlapi.asyncio import cmdgen
+from pysnmp.proto import errind, error
+from pysnmp.proto.api import v2c
+
+from . import snmp
+
+DEFAULT_COMMUNITY = snmp.DEFAULT_COMMUNITY
+DEFAULT_TIMEOUT = 0.5  # Seconds.  Agents on the LAN answer in milliseconds.
+DEFAULT_MAX_IN_FLIGHT = 1024  # Addresses being probed at the same time.
+DEFAULT_INVENTORY = "inventory.json"
+TIMER_RESOLUTION = 0.1  # pySNMP checks for timeouts every 0.5 s by default.
+DISCOVERY_RETRIES = 2  # SNMPv3 engine ID and time discovery round trips.
+
+XYTRONIX = (1, 3, 6, 1, 4, 1, 30586)  # XYTRONIX-MIB::xytronix enterprise.
+# What the inventory has polled, like the example in serve.py.
+X410_OBJECTS = [["XYTRONIX-MIB", "temp", 0], ["XYTRONIX-MIB", "vin", 0]]
+AGENT_OBJECTS = [["SNMPv2-MIB", "sysUpTime", 0]]
+
+_SYS_OBJECT_ID = (1, 3, 6, 1, 2, 1, 1, 2, 0)  # SNMPv2-MIB::sysObjectID.0
+_SYS_DESCR = (1, 3, 6, 1, 2, 1, 1, 1, 0)  # SNMPv2-MIB::sysDescr.0
+_DISCOVERY_ERRORS = (errind.notInTimeWindow, errind.unknownEngineID)
+
+Agent = collections.namedtuple("Agent", "address sys_object_id description")
+Agent.__doc__ = """An agent that answered, its sysObjectID (a tuple) and sysDescr."""
+
+
+def is_x410(sys_object_id):
+    """Returns whether the sysObjectID is one of XYTRONIX's (ControlByWeb)."""
+    return tuple(sys_object_id[: len(XYTRONIX)]) == XYTRONIX
+
+
+def addresses(networks):
+    """Yields the host addresses of the networks, as strings, without repeats.
+
+    Networks are CIDR ranges like "192.168.0.0/24", or single addresses.
+
+    """
+    seen = set()
+    for network in networks:
+        network = ipaddress.ip_network(network, strict=False)
+        hosts = network.hosts() if network.num_addresses > 1 else iter(network)
+        for address in hosts:
+            if address not in seen:
+                seen.add(address)
+                yield str(address)
+
+
+class Prober:
+    """Sends GETs to any number of addresses through one SNMP engine.
+
+    hlapi's getCmd() adds a row to the engine's SNMP-TARGET-MIB table for every
+    new address, which takes milliseconds and gets slower as the table grows: a
+    /16 would take hours in table updates alone.  The Prober configures the
+    credentials and the UDP transport once, through hlapi, and then hands
+    requests for any address straight to the engine's message dispatcher, as
+    the command generator does internally after looking up the target.
+
+    Timeouts are checked every TIMER_RESOLUTION seconds, and the request is
+    not retried.
+
+    """
+
+    def __init__(self, snmp_engine, auth_data, port=161, timeout=DEFAULT_TIMEOUT):
+        self.snmp_engine = snmp_engine
+        self.port = port
+        self.timeout = timeout
+        context = hlapi_asyncio.ContextData()
+        # The placeholder target is never sent to, it only gets the credentials
+        # and transport configured.
+        target = hlapi_asyncio.UdpTransportTarget(("127.0.0.1", port))
+        target_name, _ = cmdgen.lcd.configure(
+            snmp_engine, auth_data, target, context.contextName
+        )
+        (
+            self._domain,
+            _,
+            _,
+            _,
+            self._mp_model,
+            self._security_model,
+            self._security_name,
+            self._security_level,
+        ) = config.getTargetInfo(snmp_engine, target_name)
+        self._context_engine_id = context.contextEngineId
+        self._context_name = context.contextName
+        snmp_engine.transportDispatcher.setTimerResolution(TIMER_RESOLUTION)
+
+    def get(self, address, *oids):
+        """Returns a future of the (error indication, error status, error index,
+        var binds) of a GET of the OIDs from the address, like hlapi's getCmd().
+
+        """
+        pdu = v2c.GetRequestPDU()
+        v2c.apiPDU.setDefaults(pdu)
+        v2c.apiPDU.setVarBinds(pdu, [(oid, v2c.null) for oid in oids])
+        future = asyncio.get_event_loop().create_future()
+        self._send(address, pdu, future, 0)
+        return future
+
+    def _send(self, address, pdu, future, discoveries):
+        ticks = self.timeout / TIMER_RESOLUTION
+        try:
+            self.snmp_engine.msgAndPduDsp.sendPdu(
+                self.snmp_engine,
+                self._domain,
+                (address, self.port),
+                self._mp_model,
+                self._security_model,
+                self._security_name,
+                self._security_level,
+                self._context_engine_id,
+                self._context_name,
+                1,  # SNMPv2 PDU.
+                pdu,
+                True,
+                ticks,
+                self._on_response,
+                (address, pdu, future, discoveries),
+            )
+        except error.StatusInformation as status:
+            future.set_result((status["errorIndication"], 0, 0, []))
+
+    def _on_response(
+        self,
+        snmp_engine,
+        mp_model,
+        security_model,
+        security_name,
+        security_level,
+        context_engine_id,
+        context_name,
+        pdu_version,
+        response,
+        status,
+        send_pdu_handle,
+        context,
+    ):
+        address, request, future, discoveries = context
+        if future.cancelled():
+            return
+        if status:
+            error_indication = status["errorIndication"]
+            # An SNMPv3 agent first answers with its engine ID and time.
+            if (
+                error_indication in _DISCOVERY_ERRORS
+                and discoveries < DISCOVERY_RETRIES
+            ):
+                self._send(address, request, future, discoveries + 1)
+            else:
+                future.set_result((error_indication, 0, 0, []))
+            return
+        if v2c.apiPDU.getRequestID(response) != v2c.apiPDU.getRequestID(request):
+            future.set_result(("badResponse", 0, 0, []))
+            return
+        future.set_result(
+            (
+                None,
+                v2c.apiPDU.getErrorStatus(response),
+                v2c.apiPDU.getErrorIndex(response),
+                v2c.apiPDU.getVarBinds(response),
+            )
+        )
+
+    async def probe(self, address):
+        """Returns the Agent at the address, or None if nothing answered."""
+        results = snmp.Results()
+        results.add(*await self.get(address, _SYS_OBJECT_ID, _SYS_DESCR))
+        if results.errors or len(results) != 2:
+            return None
+        values = dict(zip(results.oids, results.values))
+        sys_object_id = values.get(_SYS_OBJECT_ID)
+        if not isinstance(sys_object_id, tuple):  # noSuchObject and the like.
+            sys_object_id = ()
+        description = values.get(_SYS_DESCR)
+        if isinstance(description, bytes):
+            description = description.decode("utf-8", "replace")
+        return Agent(address, sys_object_id, str(description or ""))
+
+
+async def sweep(prober, hosts, max_in_flight=DEFAULT_MAX_IN_FLIGHT, progress=None):
+    """Probes every address from the hosts iterable, max_in_flight at a time.
+
+    The addresses are taken from the iterable as the probes go, so sweeping a
+    /16 does not make 65534 tasks up front.  progress, if given, is called with
+    the number of addresses probed so far after each probe.  Returns the
+    Agents found, in address order.
+
+    """
+    hosts = iter(hosts)
+    agents = []
+    probed = 0
+
+    async def work():
+        nonlocal probed
+        # The workers share the iterator, each takes the next address when done.
+        for address in hosts:
+            agent = await prober.probe(address)
+            if agent is not None:
+                agents.append(agent)
+            probed += 1
+            if progress is not None:
+                progress(probed)
+
+    await asyncio.gather(*(work() for _ in range(max_in_flight)))
+    return sorted(agents, key=lambda agent: ipaddress.ip_address(agent.address))
+
+
+def make_inventory(agents, community=DEFAULT_COMMUNITY, port=161, user=None):
+    """Returns the Agents as a dict in the serve configuration file format.
+
+    The X-410s are named "x410-<address>" and poll X410_OBJECTS, other agents
+    "agent-<address>" and poll AGENT_OBJECTS.  Each device also keeps its
+    "sys_object_id" and "description", which the adapter ignores.
+
+    """
+    devices = {}
+    for agent in agents:
+        x410 = is_x410(agent.sys_object_id)
+        device = {"address": agent.address, "port": port}
+        if user is not None:
+            device["user"] = dict(user._asdict())
+        else:
+            device["community"] = community
+        device["objects"] = X410_OBJECTS if x410 else AGENT_OBJECTS
+        device["sys_object_id"] = ".".join(map(str, agent.sys_object_id))
+        device["description"] = agent.description
+        devices[f"{'x410' if x410 else 'agent'}-{agent.address}"] = device
+    return {"devices": devices}
+
+
+def load_inventory(path):
+    """Returns the devices dict of an inventory file."""
+    with open(path) as inventory_file:
+        return json.load(inventory_file).get("devices", {})
+
+
+def x410_devices(path):
+    """Returns the devices of an inventory file that are X-410s."""
+    return {
+        name: device
+        for name, device in load_inventory(path).items()
+        if is_x410(
+            tuple(
+                int(part) for part in device.get("sys_object_id", "").split(".") if part
+            )
+        )
+    }
+
+
+def discover(
+    networks,
+    community=DEFAULT_COMMUNITY,
+    port=161,
+    user=None,
+    key_cache=None,
+    timeout=DEFAULT_TIMEOUT,
+    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+    path=DEFAULT_INVENTORY,
+    x410_only=True,
+):
+    """Sweeps the networks for agents and writes them to an inventory file.
+
+    The inventory is a serve configuration file with just the devices, so it
+    can be served as is or pulled into another configuration file with its
+    "inventory" key.  Only X-410s go in unless x410_only is false.  Progress
+    and a summary are printed to stderr.  Returns the Agents found.
+
+    The inventory file is made readable by its owner only, even if it already
+    existed, as it holds the community or the V3 user's pass phrases.
+
+    """
+    hosts = list(addresses(networks))
+    snmp_engine = hlapi_asyncio.SnmpEngine()
+    snmp_engine.setUserContext(mibViewController=snmp._get_view_controller())
+    auth_data = snmp._make_auth_data(community, user=user, key_cache=key_cache)
+    prober = Prober(snmp_engine, auth_data, port, timeout)
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    next_report = start + 5
+
+    def progress(probed):
+        nonlocal next_report
+        if loop.time() >= next_report:
+            next_report += 5
+            print(f"{probed}/{len(hosts)} addresses probed", file=sys.stderr)
+
+    agents = loop.run_until_complete(
+        sweep(prober, hosts, min(max_in_flight, len(hosts) or 1), progress)
+    )
+    elapsed = loop.time() - start
+    x410s = [agent for agent in agents if is_x410(agent.sys_object_id)]
+    inventory = make_inventory(
+        x410s if x410_only else agents, community, port, user=user
+    )
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(descriptor, 0o600)  # O_CREAT's mode only applies to new files.
+    with os.fdopen(descriptor, "w") as inventory_file:
+        json.dump(inventory, inventory_file, indent=4)
+    print(
+        f"Probed {len(hosts)} addresses in {elapsed:.1f} s: {len(agents)} agents, "
+        f"{len(x410s)} X-410s.  Wrote {len(inventory['devices'])} devices to {path}",
+        file=sys.stderr,
+    )
+    return agents
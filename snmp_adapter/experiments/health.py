@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Device health tracking: adaptive timeouts and circuit breaking."""
+
+import time
+
+MIN_TIMEOUT = 0.5  # Seconds.  pySNMP's timer resolution is no better anyway.
+MAX_TIMEOUT = 10.0
+INITIAL_TIMEOUT = 1.0  # Before any round trip time has been measured.
+RETRIES = 1
+FAILURE_THRESHOLD = 3  # Consecutive timeouts before a device is marked down.
+PROBE_INTERVAL = 30.0  # Seconds between probes of a down device, doubling.
+MAX_PROBE_INTERVAL = 600.0
+
+_devices = {}
+
+
+class DeviceHealth:
+    """Round trip time estimate and circuit breaker for one device.
+
+    The timeout follows TCP's retransmission timer (RFC 6298): a smoothed RTT
+    plus four times its variance, doubled on every timeout and reset by the next
+    measured response.  RTTs are only sampled from requests that were answered
+    on the first try (Karn's algorithm).
+
+    After FAILURE_THRESHOLD timeouts in a row the device is marked down, and
+    requests to it fail immediately rather than wait out the timeout.  One probe
+    is let through every probe_interval, which doubles while the device stays
+    down.  A successful probe marks the device up again.
+
+    """
+
+    __slots__ = (
+        "srtt",
+        "rttvar",
+        "rto",
+        "failures",
+        "down_since",
+        "next_probe",
+        "probe_interval",
+    )
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_TIMEOUT
+        self.failures = 0
+        self.down_since = None
+        self.next_probe = 0.0
+        self.probe_interval = PROBE_INTERVAL
+
+    @property
+    def is_down(self):
+        return self.down_since is not None
+
+    def timeout(self):
+        """Returns the timeout to use for the next request, in seconds.
+
+        Rounded to a quarter second, as pySNMP's LCD keeps one target entry per
+        distinct timeout and would otherwise grow without bound in a daemon.
+
+        """
+        return round(min(max(self.rto, MIN_TIMEOUT), MAX_TIMEOUT) * 4) / 4
+
+    def allow(self, now=None):
+        """Returns whether a request may be sent now.
+
+        Always true while the device is up.  While it is down, true once per
+        probe interval.
+
+        """
+        if not self.is_down:
+            return True
+        now = time.monotonic() if now is None else now
+        if now < self.next_probe:
+            return False
+        self.next_probe = now + self.probe_interval
+        return True
+
+    def record_success(self, rtt=None):
+        """Records a response.  rtt is None if it is not a valid sample."""
+        if rtt is not None:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.rto = self.srtt + 4 * self.rttvar
+        elif self.srtt is not None:
+            self.rto = self.srtt + 4 * self.rttvar  # Undo any backoff.
+        self.failures = 0
+        self.down_since = None
+        self.probe_interval = PROBE_INTERVAL
+
+    def record_failure(self, now=None):
+        """Records a timed out request."""
+        now = time.monotonic() if now is None else now
+        self.failures += 1
+        self.rto = min(self.rto * 2, MAX_TIMEOUT)
+        if self.is_down:
+            self.probe_interval = min(self.probe_interval * 2, MAX_PROBE_INTERVAL)
+            self.next_probe = now + self.probe_interval
+        elif self.failures >= FAILURE_THRESHOLD:
+            self.down_since = now
+            self.next_probe = now + self.probe_interval
+
+    def __repr__(self):
+        state = "down" if self.is_down else "up"
+        srtt = "?" if self.srtt is None else f"{self.srtt * 1000:.1f}ms"
+        return f"<DeviceHealth {state} srtt={srtt} timeout={self.timeout():.2f}s>"
+
+
+def get(address, port=161):
+    """Returns the DeviceHealth for the device, creating it if needed."""
+    try:
+        return _devices[(address, port)]
+    except KeyError:
+        return _devices.setdefault((address, port), DeviceHealth())
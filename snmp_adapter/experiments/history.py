@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+"""Compact in-memory history of recently received traps."""
+
+import array
+import bisect
+import collections
+import struct
+import time
+
+DEFAULT_MAX_RECORDS = 100_000
+DEFAULT_MAX_AGE = 24 * 3600.0  # Seconds.
+
+# Value kinds in the packed var binds, see _pack().
+_NONE, _INT, _TEXT, _BYTES, _OID, _OTHER = range(6)
+_BIND = struct.Struct("<IB")  # OID id, value kind.
+_INT_VALUE = struct.Struct("<q")
+_UINT = struct.Struct("<I")  # Lengths and OID ids.
+
+TrapRecord = collections.namedtuple("TrapRecord", "time source notification var_binds")
+TrapRecord.__doc__ = """One trap from the history.
+
+notification is the snmpTrapOID value and var_binds are (OID, value) pairs,
+OIDs as tuples of ints and values native as from snmp._native().
+"""
+
+
+class _Index:
+    """Sequence numbers of the records with one source or notification.
+
+    The numbers only ever grow, so the array is sorted.  Numbers of records
+    that fell out of the history are cut off lazily, once they are the bulk.
+
+    """
+
+    __slots__ = ("sequences", "start")
+
+    def __init__(self):
+        self.sequences = array.array("Q")
+        self.start = 0
+
+    def append(self, sequence, oldest):
+        self.sequences.append(sequence)
+        if self.start * 2 > len(self.sequences):
+            del self.sequences[: self.start]
+            self.start = 0
+        if self.sequences[self.start] < oldest:
+            self.start = bisect.bisect_left(self.sequences, oldest, self.start)
+
+    def since(self, oldest):
+        """Returns the sequence numbers from oldest on."""
+        start = bisect.bisect_left(self.sequences, oldest, self.start)
+        return self.sequences[start:]
+
+
+class TrapHistory:
+    """Ring buffer of the last max_records traps, over max_age seconds at most.
+
+    Traps are stored packed rather than as pySNMP objects: sources and OIDs are
+    interned into tables and referred to by number, times, sources and
+    notifications live in typed arrays, and each trap's var binds are a single
+    bytes object with integers packed and strings as UTF-8.  That is some tens
+    of bytes per trap instead of kilobytes.
+
+    Traps are indexed by source and by notification, and kept in time order so
+    time ranges are found by bisection.  Times going backwards (clock changes)
+    are clamped to the previous trap's time.  Old traps are dropped as new ones
+    come in, so max_age counts back from the latest trap.
+
+    """
+
+    def __init__(self, max_records=DEFAULT_MAX_RECORDS, max_age=DEFAULT_MAX_AGE):
+        if max_records < 1:
+            raise ValueError(f"max_records must be at least 1, not {max_records}.")
+        if max_age is not None and max_age < 0:
+            raise ValueError(f"max_age must not be negative, not {max_age}.")
+        self.max_records = max_records
+        self.max_age = max_age
+        self._times = array.array("d", bytes(8 * max_records))
+        self._sources = array.array("I", bytes(4 * max_records))
+        self._notifications = array.array("I", bytes(4 * max_records))
+        self._var_binds = [b""] * max_records
+        self._oldest = 0  # Sequence number of the oldest trap kept.
+        self._next = 0  # Sequence number of the next trap.
+        self._strings = []  # Source addresses.
+        self._string_ids = {}
+        self._oids = []  # OID tuples.
+        self._oid_ids = {}
+        self._by_source = {}  # String id -> _Index.
+        self._by_notification = {}  # OID id -> _Index.
+
+    def __len__(self):
+        return self._next - self._oldest
+
+    def _intern_string(self, text):
+        try:
+            return self._string_ids[text]
+        except KeyError:
+            self._strings.append(text)
+            return self._string_ids.setdefault(text, len(self._strings) - 1)
+
+    def _intern_oid(self, oid):
+        try:
+            return self._oid_ids[oid]
+        except KeyError:
+            self._oids.append(oid)
+            return self._oid_ids.setdefault(oid, len(self._oids) - 1)
+
+    def _pack(self, var_binds):
+        parts = []
+        for oid, value in var_binds:
+            if value is None:
+                parts.append(_BIND.pack(self._intern_oid(oid), _NONE))
+            elif isinstance(value, int) and -(2**63) <= value < 2**63:
+                parts.append(_BIND.pack(self._intern_oid(oid), _INT))
+                parts.append(_INT_VALUE.pack(value))
+            elif isinstance(value, tuple):
+                parts.append(_BIND.pack(self._intern_oid(oid), _OID))
+                parts.append(_UINT.pack(self._intern_oid(value)))
+            else:
+                if isinstance(value, bytes):
+                    kind, data = _BYTES, value
+                elif isinstance(value, str):
+                    kind, data = _TEXT, value.encode("utf-8")
+                else:  # Large integers, noSuchObject and the like.
+                    kind, data = _OTHER, str(value).encode("utf-8")
+                parts.append(_BIND.pack(self._intern_oid(oid), kind))
+                parts.append(_UINT.pack(len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    def _unpack(self, data):
+        var_binds = []
+        offset = 0
+        while offset < len(data):
+            oid_id, kind = _BIND.unpack_from(data, offset)
+            offset += _BIND.size
+            if kind == _NONE:
+                value = None
+            elif kind == _INT:
+                (value,) = _INT_VALUE.unpack_from(data, offset)
+                offset += _INT_VALUE.size
+            else:
+                (number,) = _UINT.unpack_from(data, offset)
+                offset += _UINT.size
+                if kind == _OID:
+                    value = self._oids[number]
+                else:
+                    value = data[offset : offset + number]
+                    offset += number
+                    if kind != _BYTES:
+                        value = value.decode("utf-8")
+            var_binds.append((self._oids[oid_id], value))
+        return var_binds
+
+    def add(self, source, notification, var_binds, now=None):
+        """Records a trap.
+
+        notification and the var_binds' OIDs are tuples of ints, and the values
+        native values as from snmp._native().
+
+        """
+        now = time.time() if now is None else now
+        if self._next > self._oldest:
+            now = max(now, self._times[(self._next - 1) % self.max_records])
+        self._expire(now)
+        if self._next - self._oldest == self.max_records:
+            self._oldest += 1
+        sequence = self._next
+        position = sequence % self.max_records
+        source_id = self._intern_string(source)
+        notification_id = self._intern_oid(tuple(notification))
+        self._times[position] = now
+        self._sources[position] = source_id
+        self._notifications[position] = notification_id
+        self._var_binds[position] = self._pack(var_binds)
+        self._next += 1
+        index = self._by_source.get(source_id)
+        if index is None:
+            index = self._by_source[source_id] = _Index()
+        index.append(sequence, self._oldest)
+        index = self._by_notification.get(notification_id)
+        if index is None:
+            index = self._by_notification[notification_id] = _Index()
+        index.append(sequence, self._oldest)
+
+    def _expire(self, now):
+        """Drops the traps older than max_age."""
+        cutoff = None if self.max_age is None else now - self.max_age
+        if (
+            cutoff is None
+            or self._oldest == self._next
+            or self._time(self._oldest) >= cutoff
+        ):
+            return
+        oldest = self._find_time(cutoff)
+        for sequence in range(self._oldest, oldest):
+            self._var_binds[sequence % self.max_records] = b""
+        self._oldest = oldest
+
+    def _time(self, sequence):
+        return self._times[sequence % self.max_records]
+
+    def _find_time(self, moment, low=None, high=None):
+        """Returns the sequence number of the first trap at or after moment."""
+        low = self._oldest if low is None else low
+        high = self._next if high is None else high
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < moment:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _record(self, sequence):
+        position = sequence % self.max_records
+        return TrapRecord(
+            self._times[position],
+            self._strings[self._sources[position]],
+            self._oids[self._notifications[position]],
+            self._unpack(self._var_binds[position]),
+        )
+
+    def query(self, start=None, end=None, source=None, notification=None, limit=None):
+        """Returns the TrapRecords received from start up to (not including) end.
+
+        start and end are time.time() values, and either may be None for no
+        limit.  Only traps from the given source address and/or with the given
+        notification OID (a tuple of ints) are returned, if given.  With a limit,
+        only the most recent limit traps are returned.  Oldest first.
+
+        """
+        first = self._oldest if start is None else self._find_time(start)
+        stop = self._next if end is None else self._find_time(end, first)
+        sequences = None
+        if source is not None:
+            index = self._by_source.get(self._string_ids.get(source))
+            sequences = index.since(first) if index is not None else []
+        if notification is not None:
+            index = self._by_notification.get(self._oid_ids.get(tuple(notification)))
+            found = index.since(first) if index is not None else []
+            sequences = (
+                found
+                if sequences is None
+                else sorted(set(sequences).intersection(found))
+            )
+        if sequences is None:
+            sequences = range(first, stop)
+        else:
+            sequences = sequences[: bisect.bisect_left(sequences, stop)]
+        if limit is not None:
+            sequences = sequences[max(len(sequences) - limit, 0) :]
+        return [self._record(sequence) for sequence in sequences]
+
+    def sources(self):
+        """Returns the source addresses with traps in the history."""
+        return [
+            self._strings[source_id]
+            for source_id, index in self._by_source.items()
+            if len(index.since(self._oldest))
+        ]
+
+    def notifications(self):
+        """Returns the notification OIDs with traps in the history."""
+        return [
+            self._oids[oid_id]
+            for oid_id, index in self._by_notification.items()
+            if len(index.since(self._oldest))
+        ]
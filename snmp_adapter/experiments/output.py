@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Buffered, structured output of SNMP results and notifications."""
+
+import csv
+import io
+import json
+import sys
+import time
+
+FORMATS = ("text", "ndjson", "csv")
+DEFAULT_FORMAT = "text"
+DEFAULT_MAX_SIZE = 64 * 1024  # Bytes buffered before writing.
+DEFAULT_MAX_DELAY = 1.0  # Seconds output may sit in the buffer.
+
+_CSV_HEADER = ("type", "time", "source", "oid", "name", "value")
+
+
+class BufferedWriter:
+    """Serializes whole notifications and poll results and writes them in bulk.
+
+    Each record is formatted in one go and appended to an in-memory buffer,
+    which is written to the binary stream with a single write() once it grows
+    past max_size or gets older than max_delay seconds.  The age is only checked
+    on writes, so long running programs should also call schedule().
+
+    var_binds are sequences of (oid, name, value) strings, as from
+    snmp.Results.var_binds().  errors are (error_indication, error_text,
+    object_id) tuples, as in snmp.Results.errors.
+
+    """
+
+    def __init__(
+        self,
+        format=DEFAULT_FORMAT,
+        stream=None,
+        max_size=DEFAULT_MAX_SIZE,
+        max_delay=DEFAULT_MAX_DELAY,
+    ):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown output format {format!r}.")
+        self.format = format
+        self.stream = stream if stream is not None else sys.stdout.buffer
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._buffer = []
+        self._size = 0
+        self._first_write = None
+        self._csv_text = io.StringIO()
+        self._csv = csv.writer(self._csv_text, lineterminator="\n")
+        if format == "csv":
+            self._csv.writerow(_CSV_HEADER)
+            self._append(self._take_csv())
+
+    def _take_csv(self):
+        text = self._csv_text.getvalue()
+        self._csv_text.seek(0)
+        self._csv_text.truncate()
+        return text
+
+    def _append(self, text):
+        data = text.encode("utf-8")
+        if self._first_write is None:
+            self._first_write = time.monotonic()
+        self._buffer.append(data)
+        self._size += len(data)
+        if (
+            self._size >= self.max_size
+            or time.monotonic() - self._first_write >= self.max_delay
+        ):
+            self.flush()
+
+    def write_notification(self, source, engine_id, context, var_binds):
+        """Write one received notification.
+
+        A (host, port) source is kept as is in text, but is written as host:port
+        in the structured formats.
+
+        """
+        now = time.time()
+        if self.format != "text" and isinstance(source, tuple):
+            source = "%s:%s" % source[:2]
+        if self.format == "ndjson":
+            record = {
+                "type": "notification",
+                "time": now,
+                "source": source,
+                "engine_id": engine_id,
+                "context": context,
+                "var_binds": [
+                    {"oid": oid, "name": name, "value": value}
+                    for oid, name, value in var_binds
+                ],
+            }
+            text = json.dumps(record, separators=(",", ":")) + "\n"
+        elif self.format == "csv":
+            self._csv.writerows(
+                ("notification", now, source, oid, name, value)
+                for oid, name, value in var_binds
+            )
+            text = self._take_csv()
+        else:
+            lines = [
+                f"\nNotification from {source}, "
+                f"SNMP Engine {engine_id}, "
+                f"Context {context}"
+            ]
+            lines.extend(
+                f"    {name} ({oid}) = {value}" for oid, name, value in var_binds
+            )
+            text = "\n".join(lines) + "\n"
+        self._append(text)
+
+    def write_result(self, errors, var_binds, source=""):
+        """Write the errors and values of one command (poll).
+
+        In text, a source is written as a "source:" line before them.
+
+        """
+        now = time.time()
+        errors = [
+            (str(error_indication or ""), str(error_text or ""), str(object_id))
+            for error_indication, error_text, object_id in errors
+        ]
+        if self.format == "ndjson":
+            record = {
+                "type": "result",
+                "time": now,
+                "source": source,
+                "errors": [
+                    {"indication": indication, "status": status, "oid": object_id}
+                    for indication, status, object_id in errors
+                ],
+                "var_binds": [
+                    {"oid": oid, "name": name, "value": value}
+                    for oid, name, value in var_binds
+                ],
+            }
+            text = json.dumps(record, separators=(",", ":")) + "\n"
+        elif self.format == "csv":
+            self._csv.writerows(
+                ("error", now, source, object_id, "", indication or status)
+                for indication, status, object_id in errors
+            )
+            self._csv.writerows(
+                ("result", now, source, oid, name, value)
+                for oid, name, value in var_binds
+            )
+            text = self._take_csv()
+        else:
+            lines = [f"{source}:"] if source else []
+            lines.extend(
+                indication or f"{status} at {object_id}"
+                for indication, status, object_id in errors
+                if indication or status
+            )
+            lines.extend(f"{name} = {value}" for oid, name, value in var_binds)
+            text = "".join(line + "\n" for line in lines)
+        self._append(text)
+
+    def flush(self):
+        """Write out everything buffered so far."""
+        if self._buffer:
+            self.stream.write(b"".join(self._buffer))
+            self.stream.flush()
+            self._buffer = []
+            self._size = 0
+        self._first_write = None
+
+    def close(self):
+        """Flush the buffer.  The stream itself is left open."""
+        self.flush()
+
+    def schedule(self, loop):
+        """Flush every max_delay seconds on the asyncio loop, even when idle."""
+
+        def tick():
+            if self._first_write is not None:
+                self.flush()
+            loop.call_later(self.max_delay, tick)
+
+        loop.call_later(self.max_delay, tick)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""Long-term trap and poll storage in day-partitioned PostgreSQL tables."""
+
+import io
+import time
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from . import db
+
+DEFAULT_DATABASE = "postgresql://krys@/krys"  # Same local database as db.pgorm().
+DEFAULT_TABLE = "traps_by_day"
+DEFAULT_BATCH_SIZE = 10_000
+DEFAULT_RETENTION_DAYS = 90
+
+# Same columns as db.Traps, minus the id.  A poll result is stored with an
+# empty notification.
+COLUMNS = ("timestamp", "source", "notification", "oid", "name", "value")
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    timestamp TIMESTAMPTZ NOT NULL,
+    source TEXT NOT NULL,
+    notification TEXT NOT NULL,
+    oid TEXT NOT NULL,
+    name TEXT,
+    value TEXT
+) PARTITION BY RANGE (timestamp)
+"""
+# Created on every partition, present and future.
+_CREATE_INDEX = """
+CREATE INDEX IF NOT EXISTS {table}_source_timestamp ON {table} (source, timestamp)
+"""
+_CREATE_PARTITION = """
+CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+FOR VALUES FROM ('{day} 00:00+00') TO ('{next_day} 00:00+00')
+"""
+_SELECT_PARTITIONS = """
+SELECT child.relname FROM pg_inherits
+JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+WHERE parent.relname = :table
+"""
+
+# COPY's text format escapes.
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_field(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        if value.tzinfo is None:  # UTC, as for _day().
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def _day(timestamp):
+    """Returns the UTC date of the timestamp.  Naive timestamps are UTC."""
+    if timestamp.tzinfo is None:
+        return timestamp.date()
+    return timestamp.astimezone(timezone.utc).date()
+
+
+class PartitionedStore:
+    """Append-only storage of db.Traps-like rows, partitioned by UTC day.
+
+    Rows are buffered and written batch_size at a time with COPY FROM STDIN,
+    much cheaper than INSERTs, let alone the ORM.  The partition for each day
+    is created the first time a row for that day is written.  Old data is
+    removed by dropping whole partitions, see drop_before(), which unlike a
+    DELETE leaves nothing behind to vacuum.
+
+    Needs PostgreSQL 11 or later, and psycopg2 for COPY.
+
+    """
+
+    def __init__(
+        self,
+        database=DEFAULT_DATABASE,
+        table=DEFAULT_TABLE,
+        batch_size=DEFAULT_BATCH_SIZE,
+    ):
+        self.engine = sa.create_engine(database)
+        self.table = table
+        self.batch_size = batch_size
+        self._rows = []
+        self._days = set()  # Days known to have a partition.
+        self._copy = "COPY {} ({}) FROM STDIN".format(table, ", ".join(COLUMNS))
+
+    def create(self):
+        """Creates the partitioned table and its index, if they do not exist."""
+        with self.engine.begin() as conn:
+            conn.execute(sa.text(_CREATE_TABLE.format(table=self.table)))
+            conn.execute(sa.text(_CREATE_INDEX.format(table=self.table)))
+        self._days = set(self.partitions())
+
+    def _partition(self, day):
+        return f"{self.table}_{day:%Y%m%d}"
+
+    def partitions(self):
+        """Returns a dict of day -> partition table name."""
+        with self.engine.connect() as conn:
+            names = conn.execute(sa.text(_SELECT_PARTITIONS), table=self.table)
+            days = {}
+            for (name,) in names:
+                try:
+                    day = datetime.strptime(name[len(self.table) + 1 :], "%Y%m%d")
+                except ValueError:
+                    continue  # Not one of ours.
+                days[day.date()] = name
+        return days
+
+    def _create_partitions(self, conn, days):
+        for day in sorted(days - self._days):
+            partition = _CREATE_PARTITION.format(
+                partition=self._partition(day),
+                table=self.table,
+                day=day,
+                next_day=day + timedelta(days=1),
+            )
+            conn.execute(sa.text(partition))
+        self._days.update(days)
+
+    def write(self, rows):
+        """Adds row dicts (db.Traps columns) to the store.
+
+        Rows are only sent in batches, call flush() when done.  Returns the
+        number of rows written to the database.
+
+        """
+        self._rows.extend(rows)
+        if len(self._rows) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """Writes all buffered rows with one COPY.  Returns the number written."""
+        rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        buffer = io.StringIO()
+        buffer.writelines(
+            "\t".join(_copy_field(row.get(column)) for column in COLUMNS) + "\n"
+            for row in rows
+        )
+        buffer.seek(0)
+        days = {_day(row["timestamp"]) for row in rows}
+        try:
+            if not days <= self._days:
+                with self.engine.begin() as conn:
+                    self._create_partitions(conn, days)
+            # COPY needs the psycopg2 connection itself.
+            conn = self.engine.raw_connection()
+            try:
+                conn.cursor().copy_expert(self._copy, buffer)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception:
+            self._rows[:0] = rows  # Keep them for the next try.
+            raise
+        return len(rows)
+
+    def drop_before(self, day):
+        """Drops the partitions of days before the given date.
+
+        Returns the dropped partitions' names.
+
+        """
+        dropped = []
+        with self.engine.begin() as conn:
+            for partition_day, name in sorted(self.partitions().items()):
+                if partition_day < day:
+                    conn.execute(sa.text(f"DROP TABLE {name};"))
+                    dropped.append(name)
+                    self._days.discard(partition_day)
+        return dropped
+
+    def retain(self, days=DEFAULT_RETENTION_DAYS):
+        """Keeps today's and the previous days' partitions, drops the rest."""
+        today = datetime.now(timezone.utc).date()
+        return self.drop_before(today - timedelta(days=days))
+
+
+def _sample_rows(count, days=3):
+    """Returns count made up trap rows spread over the last few days."""
+    now = datetime.now(timezone.utc)
+    step = timedelta(days=days) / count
+    return [
+        dict(
+            timestamp=now - step * index,
+            source=f"192.168.0.{index % 50}",
+            notification="XYTRONIX-MIB::relay1Notification",
+            oid="1.3.6.1.4.1.30586.46.0.5.0",
+            name="XYTRONIX-MIB::relay1.0",
+            value=str(index % 2),
+        )
+        for index in range(count)
+    ]
+
+
+def benchmark(database=DEFAULT_DATABASE, count=100_000, batch_size=DEFAULT_BATCH_SIZE):
+    """Compares writing rows through the ORM (as db.pgorm() does) with COPY.
+
+    The ORM rows go into db.Traps' table, the COPY rows into DEFAULT_TABLE
+    partitions, in batches of batch_size.  Both are left in the database.
+
+    """
+    rows = _sample_rows(count)
+    engine = sa.create_engine(database)
+    db.Base.metadata.create_all(engine, tables=[db.Traps.__table__])
+    session = orm.sessionmaker(bind=engine)()
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        session.add_all(db.Traps(**row) for row in rows[offset : offset + batch_size])
+        session.commit()
+    orm_time = time.perf_counter() - start
+    session.close()
+
+    store = PartitionedStore(database, batch_size=batch_size)
+    store.create()
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        store.write(rows[offset : offset + batch_size])
+    store.flush()
+    copy_time = time.perf_counter() - start
+
+    print(f"{count} rows in batches of {batch_size}:")
+    print(f"ORM:  {orm_time:8.2f} s {count / orm_time:10.0f} rows/s")
+    print(f"COPY: {copy_time:8.2f} s {count / copy_time:10.0f} rows/s")
+    print(f"COPY is {orm_time / copy_time:.1f} times faster.")
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""Push API: streams trap and poll updates to (LabView) clients over sockets.
+
+Every message, both ways, is a frame: a 4 byte big-endian length followed by
+that many bytes of UTF-8 JSON.  That is easy to read from a LabView VI with two
+TCP Reads, and needs no delimiter scanning.
+
+A client subscribes by sending patterns; each frame replaces the previous
+subscription:
+
+    {"subscribe": [{"source": "x410*", "oid": "XYTRONIX-MIB::relay*"}]}
+
+"source" is matched against device names (polls) and addresses (traps), "oid"
+against both MIB names and dotted OIDs, as glob patterns.  Missing keys match
+everything.  Updates with matching var binds are pushed as:
+
+    {"type": "trap", "source": "192.168.0.132", "time": 1606435200.0,
+     "var_binds": [["1.3.6...5.0", "XYTRONIX-MIB::relay1.0", "1"]], "dropped": 0}
+
+"type" is "trap" or "poll".  A client that does not keep up has updates dropped
+rather than buffered without bound; "dropped" counts them since the last frame
+that client got.
+
+If the server has a get handler, clients can also ask for current values:
+
+    {"get": {"device": "x410", "objects": ["XYTRONIX-MIB::temp.0"]}, "id": 1}
+
+which is answered, in between updates, with a frame of "type" "get", the same
+"id", the device as "source" and either "var_binds" or an "error".  Likewise,
+with a history handler, recent traps can be asked for with filters as in
+history.TrapHistory.query():
+
+    {"history": {"source": "192.168.0.132", "start": 1606435200.0}, "id": 2}
+
+which is answered with a frame of "type" "history", the "id" and "traps" (or
+an "error"), each trap like a pushed one but with a "notification" name.
+
+A frame that is JSON but not shaped as above gets a frame of "type" "error",
+its "id" if any and the "error", and is otherwise ignored.
+
+"""
+
+import asyncio
+import fnmatch
+import json
+import struct
+import sys
+import time
+
+DEFAULT_PORT = 9162
+DEFAULT_MAX_BUFFER = 256 * 1024  # Bytes queued per client before dropping.
+MAX_FRAME = 64 * 1024  # Largest frame accepted from a client.
+
+_LENGTH = struct.Struct("!I")
+
+
+def encode_frame(message):
+    """Returns the message (JSON-able) as a length-prefixed frame."""
+    payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def _check_message(message):
+    """Raises ValueError unless the message is shaped as described above."""
+    if not isinstance(message, dict):
+        raise ValueError("Expected a JSON object.")
+    patterns = message.get("subscribe", [])
+    if not isinstance(patterns, list) or not all(
+        isinstance(pattern, dict) for pattern in patterns
+    ):
+        raise ValueError('"subscribe" must be a list of objects.')
+    if "get" in message:
+        request = message["get"]
+        if not isinstance(request, dict) or not isinstance(request.get("device"), str):
+            raise ValueError('"get" must be an object with a "device" name.')
+        if not isinstance(request.get("objects", []), list):
+            raise ValueError('"get" "objects" must be a list.')
+    if not isinstance(message.get("history", {}), dict):
+        raise ValueError('"history" must be an object.')
+
+
+class Client:
+    """One connected client, its subscriptions and its send buffer."""
+
+    __slots__ = ("writer", "patterns", "dropped", "_matches")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.patterns = []  # (source pattern, oid pattern) pairs.
+        self.dropped = 0
+        self._matches = {}  # (source, oid) -> bool, see matches().
+
+    def subscribe(self, patterns):
+        self.patterns = [
+            (pattern.get("source", "*"), pattern.get("oid", "*"))
+            for pattern in patterns
+        ]
+        self._matches.clear()
+
+    def matches(self, source, oid, name):
+        """Returns whether the client subscribed to the OID.  Cached."""
+        key = (source, oid)
+        try:
+            return self._matches[key]
+        except KeyError:
+            pass
+        match = any(
+            fnmatch.fnmatchcase(source, source_pattern)
+            and (
+                fnmatch.fnmatchcase(name, oid_pattern)
+                or fnmatch.fnmatchcase(oid, oid_pattern)
+            )
+            for source_pattern, oid_pattern in self.patterns
+        )
+        self._matches[key] = match
+        return match
+
+    def send(self, message, max_buffer):
+        """Queues the message, or drops it if the client is too far behind."""
+        transport = self.writer.transport
+        if transport.is_closing() or transport.get_write_buffer_size() > max_buffer:
+            self.dropped += 1
+            return
+        message["dropped"] = self.dropped
+        self.dropped = 0
+        self.writer.write(encode_frame(message))
+
+
+class PushServer:
+    """TCP or Unix domain socket server pushing updates to subscribed clients.
+
+    publish() never waits: it queues frames on each client's transport, and
+    clients whose buffer is over max_buffer bytes miss out on updates until
+    they catch up, so a slow client can not hold up the listener or pollers.
+
+    """
+
+    def __init__(
+        self, max_buffer=DEFAULT_MAX_BUFFER, get_handler=None, history_handler=None
+    ):
+        self.max_buffer = max_buffer
+        self.get_handler = get_handler  # Coroutine function (device, objects).
+        self.history_handler = history_handler  # Coroutine function (**filters).
+        self.clients = set()
+        self._server = None
+
+    async def start(self, address="127.0.0.1", port=DEFAULT_PORT, path=None):
+        """Starts listening on the Unix socket path if given, otherwise TCP."""
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self._server = await asyncio.start_server(self._handle, address, port)
+
+    async def stop(self):
+        self._server.close()
+        # Newer Pythons' wait_closed() waits for the connections to end.
+        for client in list(self.clients):
+            client.writer.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        client = Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                length = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+                if length > MAX_FRAME:
+                    break
+                message = json.loads(await reader.readexactly(length))
+                try:
+                    _check_message(message)
+                except ValueError as exception:
+                    reply = {"type": "error", "error": str(exception)}
+                    if isinstance(message, dict):
+                        reply["id"] = message.get("id")
+                    writer.write(encode_frame(reply))
+                    continue
+                if "subscribe" in message:
+                    client.subscribe(message["subscribe"])
+                if "get" in message and self.get_handler is not None:
+                    asyncio.ensure_future(self._answer_get(client, message))
+                if "history" in message and self.history_handler is not None:
+                    asyncio.ensure_future(self._answer_history(client, message))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ValueError, AttributeError) as exception:
+            print(f"Bad frame from push client: {exception}", file=sys.stderr)
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def _answer_get(self, client, message):
+        request = message["get"]
+        reply = {"type": "get", "id": message.get("id"), "source": request["device"]}
+        await self._answer(
+            client,
+            reply,
+            "var_binds",
+            self.get_handler,
+            request["device"],
+            request.get("objects", []),
+        )
+
+    async def _answer_history(self, client, message):
+        reply = {"type": "history", "id": message.get("id")}
+        await self._answer(
+            client, reply, "traps", self.history_handler, **message["history"]
+        )
+
+    @staticmethod
+    async def _answer(client, reply, key, handler, *args, **kwargs):
+        try:
+            reply[key] = await handler(*args, **kwargs)
+        except Exception as exception:  # Report anything back to the client.
+            reply["error"] = f"{type(exception).__name__}: {exception}"
+        # Answers are never dropped, the client is waiting for them.
+        if not client.writer.transport.is_closing():
+            client.writer.write(encode_frame(reply))
+
+    def publish(self, kind, source, var_binds):
+        """Pushes an update to the clients subscribed to any of its var binds.
+
+        var_binds are (dotted OID, MIB name, value) strings.
+
+        """
+        if not self.clients:
+            return
+        now = time.time()
+        for client in self.clients:
+            selected = [
+                var_bind
+                for var_bind in var_binds
+                if client.matches(source, var_bind[0], var_bind[1])
+            ]
+            if selected:
+                message = {
+                    "type": kind,
+                    "source": source,
+                    "time": now,
+                    "var_binds": selected,
+                }
+                client.send(message, self.max_buffer)
@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+
+"""Long-running SNMP adapter: trap listener, pollers and sinks on one loop."""
+
+import asyncio
+import fnmatch
+import json
+import os
+import signal
+import socket
+import sys
+import time
+
+from pysnmp.carrier.asyncio.dgram import udp
+from pysnmp.entity import config, engine
+from pysnmp.entity.rfc3413 import ntfrcv
+from pysnmp.hlapi import asyncio as hlapi_asyncio
+
+from . import cache, discover, health, history, output, push, snmp, usm
+
+DEFAULT_CONFIG = "snmp_adapter.json"
+DEFAULT_INTERVAL = 10.0  # Seconds between polls of a device.
+
+_SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)  # SNMPv2-MIB::snmpTrapOID.0
+_LISTEN_DOMAIN = udp.domainName + (1,)
+
+# An example configuration file:
+#
+# {
+#     "mibs": ["XYTRONIX-MIB"],
+#     "listen": {"address": "0.0.0.0", "port": 162, "community": "public"},
+#     "devices": {
+#         "x410": {
+#             "address": "192.168.0.132",
+#             "community": "webrelay",
+#             "interval": 5,
+#             "objects": [["XYTRONIX-MIB", "temp", 0], ["XYTRONIX-MIB", "vin", 0]]
+#         }
+#     },
+#     "rules": [{"notification": "XYTRONIX-MIB::relay*", "source": "192.168.0.*"}],
+#     "push": {"address": "127.0.0.1", "port": 9162},
+#     "cache": {"ttl": 1.0, "ttls": {"XYTRONIX-MIB::temp": 5}},
+#     "history": {"max_records": 100000, "max_age": 86400},
+#     "inventory": "inventory.json"
+# }
+#
+# "listen" may also have a "user" (usm.make_user() arguments) and "engine_ids"
+# for SNMPv3 traps, and devices may have a "user" instead of a "community".
+# Notifications are only output if they match one of the rules' glob patterns,
+# or if there are no rules.  "push" starts a push.PushServer; it takes a Unix
+# socket "path" instead of an address and port, and an optional "max_buffer".
+# "cache" sets how many seconds values are served from the cache.ValueCache to
+# push clients' gets, by default and for given objects and their subtrees.
+# "history" sizes the history.TrapHistory of all received traps (whether or not
+# they match the rules) that push clients can query.  "inventory" adds the
+# devices of a file written by discover.discover() (relative to this file), with
+# the same named devices here taking precedence; it is re-read on reload too.
+
+
+def load_config(path):
+    """Returns the configuration file as a dict with all sections present."""
+    with open(path) as config_file:
+        configuration = json.load(config_file)
+    configuration.setdefault("mibs", [])
+    configuration.setdefault("listen", {})
+    configuration.setdefault("devices", {})
+    configuration.setdefault("rules", [])
+    configuration.setdefault("push", None)
+    configuration.setdefault("cache", {})
+    configuration.setdefault("history", {})
+    if configuration.get("inventory"):
+        inventory_path = os.path.join(os.path.dirname(path), configuration["inventory"])
+        devices = discover.load_inventory(inventory_path)
+        devices.update(configuration["devices"])
+        configuration["devices"] = devices
+    return configuration
+
+
+def _parse_oid(identity):
+    """Returns the OID tuple of an object identity from the configuration.
+
+    That is a dotted OID, a "MODULE::name.index" string (the index is optional)
+    or a [module, name, index...] list.
+
+    """
+    if isinstance(identity, str):
+        if "::" not in identity:
+            return tuple(int(part) for part in identity.strip(".").split("."))
+        module, name = identity.split("::", 1)
+        name, *index = name.split(".")
+        identity = [module, name] + [int(part) for part in index]
+    return tuple(snmp._make_object(*identity)[0].getOid())
+
+
+class _ListenTransport(udp.UdpTransport):
+    """UDP transport whose socket is bound right away, raising OSError if not.
+
+    pySNMP binds in a task, so a bad address would only show up as an exception
+    nobody retrieves, and no traps.  Likewise the socket is closed right away
+    rather than on the next loop iteration, so its port can be bound again.
+    No SO_REUSEADDR, so another adapter can not share (steal) the port.
+
+    """
+
+    def openServerMode(self, iface):
+        sock = socket.socket(self.sockFamily, socket.SOCK_DGRAM)
+        try:
+            sock.bind(iface)
+        except OSError:
+            sock.close()
+            raise
+        self._listen_socket = sock
+        self._lport = asyncio.ensure_future(
+            self.loop.create_datagram_endpoint(lambda: self, sock=sock)
+        )
+        return self
+
+    def closeTransport(self):
+        super().closeTransport()  # Stops reading from the socket.
+        self._listen_socket.close()
+
+
+class Adapter:
+    """Runs the trap listener and device pollers according to a config file.
+
+    The MIB view and both SNMP engines (one receiving, one polling) are created
+    once and survive reloads.  A reload only touches what changed: pollers of
+    unchanged devices keep running, and the listening socket is only reopened
+    when its address changes.
+
+    """
+
+    def __init__(self, config_path, writer=None, key_cache_path=usm.DEFAULT_KEY_CACHE):
+        self.config_path = config_path
+        self.writer = writer if writer is not None else output.BufferedWriter()
+        self.key_cache = usm.KeyCache(key_cache_path)
+        self.config = {
+            "mibs": [],
+            "listen": None,
+            "devices": {},
+            "rules": [],
+            "push": None,
+            "cache": {},
+            "history": {},
+        }
+        self.cache = cache.ValueCache()
+        self.history = history.TrapHistory()
+        self.push_server = None
+        self._pollers = {}  # Device name -> asyncio Task.
+        self._loop = None
+        self._listen_engine = None
+        self._poll_engine = None
+
+    def start(self, loop):
+        """Load the configuration and start everything on the loop."""
+        self._loop = loop
+        snmp._get_view_controller()
+        self._listen_engine = engine.SnmpEngine()
+        ntfrcv.NotificationReceiver(self._listen_engine, self._on_notification)
+        self._poll_engine = hlapi_asyncio.SnmpEngine()
+        self._poll_engine.setUserContext(mibViewController=snmp._view_controller)
+        self.writer.schedule(loop)
+        self.apply(load_config(self.config_path))
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+
+    def reload(self):
+        """Re-read the configuration file and apply the differences."""
+        try:
+            configuration = load_config(self.config_path)
+        except (OSError, ValueError) as exception:
+            print(
+                f"Reload failed, keeping old configuration: {exception}",
+                file=sys.stderr,
+            )
+            return
+        try:
+            self.apply(configuration)
+        except ValueError as exception:
+            print(
+                f"Reload failed, keeping old configuration: {exception}",
+                file=sys.stderr,
+            )
+            return
+        print(f"Reloaded {self.config_path}", file=sys.stderr)
+
+    def apply(self, configuration):
+        """Reconfigure to match the given configuration dict.
+
+        Whatever changed is resolved and checked before anything is touched.
+        If any of it is wrong, a ValueError listing every problem (per device)
+        is raised and the old configuration stays in place, except for new MIBs
+        which stay loaded.
+
+        """
+        new_mibs = [
+            mib for mib in configuration["mibs"] if mib not in self.config["mibs"]
+        ]
+        if new_mibs:
+            try:
+                # The view controller re-indexes itself when the builder changes.
+                snmp._view_controller.mibBuilder.loadModules(*new_mibs)
+            except Exception as exception:
+                raise ValueError(f"mibs: {exception}") from exception
+            snmp._symbol_index = None
+        prepared = self._prepare(configuration)
+        if configuration["listen"] != self.config["listen"]:
+            self._configure_listener(
+                self.config["listen"] or {},
+                configuration["listen"],
+                prepared["listen_user"],
+            )
+        old_devices = self.config["devices"]
+        new_devices = configuration["devices"]
+        for name, device in old_devices.items():
+            if new_devices.get(name) != device:
+                self._pollers.pop(name).cancel()
+        for name, (interval, auth_data, objects) in prepared["devices"].items():
+            self._pollers[name] = self._loop.create_task(
+                self._poll_forever(
+                    name, new_devices[name], interval, auth_data, objects
+                )
+            )
+        if configuration["cache"] != self.config["cache"]:
+            # Keep the values already cached; only their lifetimes change.
+            self.cache.default_ttl = configuration["cache"].get(
+                "ttl", cache.DEFAULT_TTL
+            )
+            self.cache.clear_ttls()
+            for oid, ttl in prepared["ttls"]:
+                self.cache.set_ttl(oid, ttl)
+        if configuration["history"] != self.config["history"]:
+            # Resizing starts over with an empty history.
+            self.history = prepared["history"]
+        if configuration["push"] != self.config["push"]:
+            task = self._loop.create_task(self._configure_push(configuration["push"]))
+            task.add_done_callback(self._report_push)
+        self.config = configuration
+
+    def _prepare(self, configuration):
+        """Resolves the parts of the configuration that changed, for apply().
+
+        Nothing is changed.  Returns a dict of the listener's SNMPv3 user, the
+        (interval, auth data, objects) of new or changed devices, cache TTLs and
+        a new history.  Raises ValueError naming every part that does not resolve.
+
+        """
+        prepared = {"listen_user": None, "devices": {}, "ttls": [], "history": None}
+        errors = []
+        if configuration["listen"] != self.config["listen"]:
+            try:
+                prepared["listen_user"] = self._make_listen_user(
+                    configuration["listen"]
+                )
+            except Exception as exception:
+                errors.append(f"listen: {exception!r}")
+        old_devices = self.config["devices"]
+        for name, device in configuration["devices"].items():
+            if old_devices.get(name) != device:
+                try:
+                    prepared["devices"][name] = self._prepare_device(device)
+                except Exception as exception:
+                    errors.append(f"device {name}: {exception!r}")
+        if configuration["cache"] != self.config["cache"]:
+            try:
+                prepared["ttls"] = [
+                    (_parse_oid(name), float(ttl))
+                    for name, ttl in configuration["cache"].get("ttls", {}).items()
+                ]
+            except Exception as exception:
+                errors.append(f"cache: {exception!r}")
+        if configuration["history"] != self.config["history"]:
+            try:
+                prepared["history"] = history.TrapHistory(
+                    configuration["history"].get(
+                        "max_records", history.DEFAULT_MAX_RECORDS
+                    ),
+                    configuration["history"].get("max_age", history.DEFAULT_MAX_AGE),
+                )
+            except Exception as exception:
+                errors.append(f"history: {exception!r}")
+        if errors:
+            raise ValueError("; ".join(errors))
+        return prepared
+
+    def _make_listen_user(self, listen):
+        """Returns the listener's usm.V3User, or None.  Checks its keys."""
+        if not listen or not listen.get("user"):
+            return None
+        user = usm.make_user(**listen["user"])
+        # Derives the keys and looks up the protocols, as usm.add_user() will.
+        usm.make_auth_data(user, self.key_cache)
+        for engine_id in listen.get("engine_ids", ()):
+            bytes.fromhex(engine_id)
+        return user
+
+    def _prepare_device(self, device):
+        """Returns the interval, auth data and resolved objects to poll with."""
+        if not device.get("address"):
+            raise ValueError("No address.")
+        interval = float(device.get("interval", DEFAULT_INTERVAL))
+        if interval <= 0:
+            raise ValueError(f"Interval {interval} is not positive.")
+        auth_data = self._make_auth_data(device)
+        objects = [
+            snmp._make_object(*([obj] if isinstance(obj, str) else obj))
+            for obj in device.get("objects", ())
+        ]
+        return interval, auth_data, objects
+
+    async def _configure_push(self, push_config):
+        if self.push_server is not None:
+            await self.push_server.stop()
+            self.push_server = None
+        if push_config is None:
+            return
+        server = push.PushServer(
+            push_config.get("max_buffer", push.DEFAULT_MAX_BUFFER),
+            get_handler=self.get,
+            history_handler=self.query_history,
+        )
+        await server.start(
+            push_config.get("address", "127.0.0.1"),
+            push_config.get("port", push.DEFAULT_PORT),
+            push_config.get("path"),
+        )
+        self.push_server = server
+
+    @staticmethod
+    def _report_push(task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Push server failed: {task.exception()!r}", file=sys.stderr)
+
+    def _configure_listener(self, old, new, user=None):
+        address = (
+            new.get("address", snmp.DEFAULT_ADDRESSS),
+            new.get("port", snmp.DEFAULT_PORT),
+        )
+        old_address = (
+            old.get("address", snmp.DEFAULT_ADDRESSS),
+            old.get("port", snmp.DEFAULT_PORT),
+        )
+        if not old or address != old_address:
+            # The new socket is bound before the old one is closed, so if it
+            # can not be, the old configuration stays as it is.  On the same
+            # port the old one has to go first, and is bound again on failure.
+            closed = False
+            if old and address[1] == old_address[1]:
+                config.delTransport(
+                    self._listen_engine, _LISTEN_DOMAIN
+                ).closeTransport()
+                closed = True
+            try:
+                transport = _ListenTransport().openServerMode(address)
+            except OSError as exception:
+                if closed:
+                    config.addTransport(
+                        self._listen_engine,
+                        _LISTEN_DOMAIN,
+                        _ListenTransport().openServerMode(old_address),
+                    )
+                raise ValueError(f"listen: {exception}") from exception
+            if old and not closed:
+                config.delTransport(
+                    self._listen_engine, _LISTEN_DOMAIN
+                ).closeTransport()
+            config.addTransport(self._listen_engine, _LISTEN_DOMAIN, transport)
+            print(
+                f"Listening for SNMP traps on {address[0]}, Port: {address[1]}",
+                file=sys.stderr,
+            )
+        community = new.get("community", snmp.DEFAULT_COMMUNITY)
+        if old.get("community", snmp.DEFAULT_COMMUNITY) != community:
+            config.delV1System(
+                self._listen_engine, old.get("community", snmp.DEFAULT_COMMUNITY)
+            )
+        config.addV1System(self._listen_engine, community, community)
+        if old.get("user"):  # Revoked, or replaced below.
+            usm.remove_user(
+                self._listen_engine, old["user"]["name"], old.get("engine_ids", ())
+            )
+        if user is not None:
+            usm.add_user(
+                self._listen_engine, user, self.key_cache, new.get("engine_ids", ())
+            )
+
+    def _matches(self, source, notification):
+        rules = self.config["rules"]
+        return not rules or any(
+            fnmatch.fnmatchcase(notification, rule.get("notification", "*"))
+            and fnmatch.fnmatchcase(source, rule.get("source", "*"))
+            for rule in rules
+        )
+
+    def _on_notification(
+        self,
+        snmp_engine,
+        state_reference,
+        context_engine_id,
+        context_name,
+        var_binds,
+        callback_context,
+    ):
+        _, transport_address = snmp_engine.msgAndPduDsp.getTransportInfo(
+            state_reference
+        )
+        native_var_binds = [
+            (tuple(oid), snmp._native(value)) for oid, value in var_binds
+        ]
+        notification_oid = next(
+            (value for oid, value in native_var_binds if oid == _SNMP_TRAP_OID), ()
+        )
+        notification = snmp._describe(notification_oid)[1] if notification_oid else ""
+        now = time.monotonic()
+        for oid, value in native_var_binds:
+            self.cache.update(transport_address[0], oid, value, now)
+        self.history.add(transport_address[0], notification_oid, native_var_binds)
+        if not self._matches(transport_address[0], notification):
+            return
+        var_binds = [
+            snmp._describe(oid) + (value.prettyPrint(),) for oid, value in var_binds
+        ]
+        self.writer.write_notification(
+            transport_address,
+            context_engine_id.prettyPrint(),
+            context_name.prettyPrint(),
+            var_binds,
+        )
+        if self.push_server is not None:
+            self.push_server.publish("trap", transport_address[0], var_binds)
+
+    async def _fetch(self, device, auth_data, objects):
+        """GETs the objects from the device, and returns snmp.Results."""
+        address = device["address"]
+        port = device.get("port", 161)
+        device_health = health.get(address, port)
+        results = snmp.Results()
+        if not device_health.allow():
+            results.add(f"{address}:{port} is down, request skipped", 0, 0, [])
+            return results
+        timeout = device_health.timeout()
+        target = hlapi_asyncio.UdpTransportTarget(
+            (address, port), timeout=timeout, retries=health.RETRIES
+        )
+        start = self._loop.time()
+        result = await hlapi_asyncio.getCmd(
+            self._poll_engine,
+            auth_data,
+            target,
+            hlapi_asyncio.ContextData(),
+            *objects,
+            lookupMib=False,
+        )
+        elapsed = self._loop.time() - start
+        snmp._record_health(device_health, result[0], elapsed, timeout)
+        results.add(*result)
+        now = time.monotonic()
+        for oid, value in zip(results.oids, results.values):
+            self.cache.update(address, oid, value, now)
+        return results
+
+    async def _poll(self, name, device, auth_data, objects):
+        results = await self._fetch(device, auth_data, objects)
+        var_binds = results.var_binds()
+        self.writer.write_result(results.errors, var_binds, source=name)
+        if self.push_server is not None and var_binds:
+            self.push_server.publish("poll", name, var_binds)
+
+    async def get(self, name, objects):
+        """Returns (dotted OID, MIB name, value) strings of objects of a device.
+
+        objects are _make_object() identities.  Values come from the cache when
+        fresh enough.  Raises KeyError for unknown devices and cache.FetchError
+        if the device could not be read.
+
+        """
+        device = self.config["devices"][name]
+        auth_data = self._make_auth_data(device)
+        oids = [_parse_oid(identity) for identity in objects]
+
+        async def fetch(missing):
+            results = await self._fetch(
+                device, auth_data, [snmp._make_object(oid) for oid in missing]
+            )
+            if results.errors:
+                error_indication, error_text, object_id = results.errors[0]
+                raise cache.FetchError(
+                    str(error_indication or f"{error_text} at {object_id}")
+                )
+            return dict(zip(results.oids, results.values))
+
+        values = await self.cache.get(device["address"], oids, fetch)
+        return [
+            snmp._describe(oid) + (snmp._format_value(values[oid]),) for oid in oids
+        ]
+
+    async def query_history(self, source=None, notification=None, **filters):
+        """Returns traps from the history as JSON-able dicts.
+
+        notification is a configuration object identity (see _parse_oid()), the
+        other filters are those of history.TrapHistory.query().
+
+        """
+        if notification is not None:
+            notification = _parse_oid(notification)
+        return [
+            {
+                "time": record.time,
+                "source": record.source,
+                "notification": (
+                    snmp._describe(record.notification)[1]
+                    if record.notification
+                    else ""
+                ),
+                "var_binds": [
+                    snmp._describe(oid) + (snmp._format_value(value),)
+                    for oid, value in record.var_binds
+                ],
+            }
+            for record in self.history.query(
+                source=source, notification=notification, **filters
+            )
+        ]
+
+    def _make_auth_data(self, device):
+        if device.get("user"):
+            user = usm.make_user(**device["user"])
+            return usm.make_auth_data(user, self.key_cache)
+        return snmp._make_auth_data(
+            device.get("community", snmp.DEFAULT_COMMUNITY),
+            device.get("mp_model", 1),
+        )
+
+    async def _poll_forever(self, name, device, interval, auth_data, objects):
+        """Poll one device every interval seconds until cancelled."""
+        while True:
+            # Sleep until the next tick rather than interval after a slow poll.
+            next_poll = self._loop.time() + interval
+            try:
+                await self._poll(name, device, auth_data, objects)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exception:  # Keep polling whatever happens.
+                print(f"Polling {name} failed: {exception!r}", file=sys.stderr)
+            await asyncio.sleep(max(0, next_poll - self._loop.time()))
+
+
+def serve(
+    config_path=DEFAULT_CONFIG, writer=None, key_cache_path=usm.DEFAULT_KEY_CACHE
+):
+    """Run the adapter until interrupted.  SIGHUP reloads the configuration."""
+    loop = asyncio.get_event_loop()
+    adapter = Adapter(config_path, writer, key_cache_path)
+    try:
+        adapter.start(loop)
+    except (OSError, ValueError) as exception:
+        print(f"Bad configuration in {config_path}: {exception}", file=sys.stderr)
+        sys.exit(1)
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    print("Press CTRL-C to quit, send SIGHUP to reload.", file=sys.stderr, flush=True)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        adapter.writer.close()
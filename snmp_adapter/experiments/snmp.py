@@ -3,38 +3,158 @@
 """SNMP Experiments."""
 
 import asyncio
+import ipaddress
+import os
+import sys
+import time
 import warnings
 
+from pyasn1.type import univ
 from pysnmp import hlapi
 from pysnmp.entity import engine, config
 from pysnmp.carrier.asyncio.dgram import udp
 from pysnmp.entity.rfc3413 import ntfrcv
+from pysnmp.proto import errind, rfc1902 as proto_rfc1902, rfc1905
 from pysnmp.smi import builder, compiler, view, rfc1902
 
+from . import health, output, usm
+
 DEFAULT_ADDRESSS = "0.0.0.0"
 DEFAULT_PORT = 162
 DEFAULT_COMMUNITY = "public"
 DEFAULT_MIBS = ("SNMPv2-MIB", "IF-MIB", "XYTRONIX-MIB")  # Must be a tuple not a list.
+DEFAULT_MIB_DIRS = ("mibs",)  # Searched before the pysmi default sources.
+MAX_INTERNED_OIDS = 10_000  # Distinct OIDs shared between Results, see Results.
+MAX_DESCRIPTIONS = 10_000  # OIDs whose descriptions are cached, see _describe().
 
 _view_controller = None
+_symbol_index = None  # (module, name) -> (OID tuple, syntax), see _get_symbol_index().
+_objects = {}  # id_parts -> resolved ObjectType, see _make_object().
+_writer = None
+_descriptions = {}  # OID tuple -> (dotted OID, MIB name), see _describe().
+
+
+def _make_view_controller(mibs=DEFAULT_MIBS, mib_dirs=DEFAULT_MIB_DIRS):
+    """Load the given MIBs and return a MibViewController for them.
+
+    MIB sources are searched for in mib_dirs first, then the pysmi defaults.
+    Compiled MIBs are cached by pysmi, so this is only slow the first time.
+
+    """
+    mib_builder = builder.MibBuilder()
+    sources = [f"file://{os.path.abspath(path)}" for path in mib_dirs]
+    compiler.addMibCompiler(
+        mib_builder, sources=sources + list(compiler.defaultSources)
+    )
+    mib_builder.loadModules(*mibs)
+    return view.MibViewController(mib_builder)
+
+
+def _get_symbol_index():
+    """Returns a dict of (module, name) -> (OID tuple, syntax) for the loaded MIBs.
+
+    Built once.  syntax is None for nodes without a value, e.g. notifications.
+
+    """
+    global _symbol_index
+    if _symbol_index is None:
+        mib_builder = _get_view_controller().mibBuilder
+        (MibNode,) = mib_builder.importSymbols("SNMPv2-SMI", "MibNode")
+        _symbol_index = {
+            (module, name): (tuple(symbol.name), getattr(symbol, "syntax", None))
+            for module, symbols in mib_builder.mibSymbols.items()
+            for name, symbol in symbols.items()
+            if isinstance(symbol, MibNode)
+        }
+    return _symbol_index
 
 
 def _make_object(*id_parts):
-    """Construct a pySNMP ObjectType from the given identity."""
-    return hlapi.ObjectType(hlapi.ObjectIdentity(*id_parts))
+    """Construct a pySNMP ObjectType from the given identity.
 
+    The object is resolved against the MIB once and then reused from a cache,
+    so pySNMP skips MIB resolution when it is used in a request.
+    (module, name, index...) identities are turned into numeric OIDs through
+    the symbol index rather than a symbolic MIB lookup.
 
-def _make_get(address, community, *objects, port=161, mp_model=1):
+    """
+    try:
+        return _objects[id_parts]
+    except KeyError:
+        pass
+    identity = id_parts
+    if len(id_parts) >= 2 and all(isinstance(part, int) for part in id_parts[2:]):
+        symbol = _get_symbol_index().get(id_parts[:2])
+        if symbol is not None:
+            identity = (symbol[0] + id_parts[2:],)
+    object_type = hlapi.ObjectType(hlapi.ObjectIdentity(*identity))
+    object_type.resolveWithMib(_get_view_controller())
+    _objects[id_parts] = object_type
+    return object_type
+
+
+def _make_auth_data(community, mp_model=1, user=None, key_cache=None):
+    """Returns SNMPv3 USM data if a user is given, otherwise v1/v2c community data."""
+    if user is not None:
+        return usm.make_auth_data(user, key_cache or usm.KeyCache())
+    return hlapi.CommunityData(community, mpModel=mp_model)
+
+
+def _make_get(
+    address, community, *objects, port=161, mp_model=1, user=None, key_cache=None
+):
     """Construct a pySNMP get command.
 
-    Defaults to SNMPv2c and port 161.
+    Defaults to SNMPv2c and port 161.  Uses SNMPv3 instead if a usm.V3User is given.
+    The timeout adapts to the device's response times, see health.DeviceHealth.
 
     """
     engine = hlapi.SnmpEngine()
-    community = hlapi.CommunityData(community, mpModel=mp_model)
-    target = hlapi.UdpTransportTarget((address, port))
+    # Share the already loaded MIB view rather than have pySNMP build its own.
+    engine.setUserContext(mibViewController=_get_view_controller())
+    community = _make_auth_data(community, mp_model, user, key_cache)
+    device = health.get(address, port)
+    target = hlapi.UdpTransportTarget(
+        (address, port), timeout=device.timeout(), retries=health.RETRIES
+    )
     context = hlapi.ContextData()
-    return hlapi.getCmd(engine, community, target, context, *objects)
+    # Responses are not resolved against the MIB.  Results does that lazily.
+    command = hlapi.getCmd(
+        engine, community, target, context, *objects, lookupMib=False
+    )
+    return _track_health(command, device, f"{address}:{port}")
+
+
+def _track_health(command, device, name):
+    """Wraps a pySNMP command iterator to keep the device's health up to date.
+
+    Nothing is sent while the device is down, outside of the occasional probe.
+    A skipped command results in an error indication, like a timeout would.
+    Once let through, the command runs to the end, even if a timeout along the
+    way marks the device down.
+
+    """
+    timeout = device.timeout()
+    if not device.allow():
+        yield (f"{name} is down, request skipped", 0, 0, [])
+        return
+    while True:
+        start = time.monotonic()
+        try:
+            result = next(command)
+        except StopIteration:
+            return
+        _record_health(device, result[0], time.monotonic() - start, timeout)
+        yield result
+
+
+def _record_health(device, error_indication, elapsed, timeout):
+    """Updates the device's health with the outcome of one request."""
+    if isinstance(error_indication, errind.RequestTimedOut):
+        device.record_failure()
+    else:
+        # Slower than the timeout means it was retried; not a valid sample.
+        device.record_success(elapsed if elapsed < timeout else None)
 
 
 def _run_command(command):
@@ -44,29 +164,182 @@ def _run_command(command):
     return [result for result in command]
 
 
-def _extract_errors(results):
-    """Returns a list of error tuples if any errors exist in the results.
+def _get_view_controller():
+    """Returns the MIB view, loading the default MIBs if none is loaded yet."""
+    global _view_controller
+    if _view_controller is None:
+        _view_controller = _make_view_controller()
+    return _view_controller
+
+
+def _describe(oid, object_identity=None):
+    """Returns (dotted OID, MIB name) strings for the OID (any sequence of ints).
 
-    Each error tuple consists of (error_indication, error_status, error_index).
+    Names are resolved with the MIB view unless an already resolved
+    object_identity is given.  Results are cached, as prettyPrint() and MIB
+    lookups are slow and the same few OIDs are seen over and over.  Only the
+    first MAX_DESCRIPTIONS OIDs are, so arbitrary trap OIDs can not grow the
+    cache forever.
+
+    """
+    key = tuple(oid)
+    try:
+        return _descriptions[key]
+    except KeyError:
+        pass
+    dotted = ".".join(str(part) for part in key)
+    if object_identity is None:
+        object_identity = rfc1902.ObjectIdentity(dotted)
+        object_identity.resolveWithMib(_get_view_controller())
+    description = (dotted, object_identity.prettyPrint())
+    if len(_descriptions) < MAX_DESCRIPTIONS:
+        _descriptions[key] = description
+    return description
+
+
+def _native(value):
+    """Converts a pySNMP value into a plain Python value.
+
+    The noSuchObject, noSuchInstance and endOfMibView markers are kept as is.
+
+    """
+    if isinstance(
+        value, (rfc1905.NoSuchObject, rfc1905.NoSuchInstance, rfc1905.EndOfMibView)
+    ):
+        return value
+    if isinstance(value, univ.Null):
+        return None
+    if isinstance(value, univ.Integer):
+        return int(value)
+    if isinstance(value, univ.ObjectIdentifier):
+        return tuple(value)
+    if isinstance(value, proto_rfc1902.IpAddress):
+        return str(ipaddress.IPv4Address(value.asOctets()))
+    if isinstance(value, univ.OctetString):
+        octets = value.asOctets()
+        try:
+            text = octets.decode("utf-8")
+        except UnicodeDecodeError:
+            return octets
+        return text if text.isprintable() else octets
+    return value.prettyPrint()
+
+
+def _format_value(value):
+    """Formats a value, native or pySNMP, like prettyPrint() would."""
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    if isinstance(value, tuple):
+        return ".".join(str(part) for part in value)
+    if hasattr(value, "prettyPrint"):
+        return value.prettyPrint()
+    return str(value)
+
+
+class ResultRow:
+    """A view of one OID and its value in Results.  The name is resolved lazily."""
+
+    __slots__ = ("_results", "_index")
+
+    def __init__(self, results, index):
+        self._results = results
+        self._index = index
+
+    @property
+    def oid(self):
+        return self._results.oids[self._index]
+
+    @property
+    def value(self):
+        return self._results.values[self._index]
+
+    @property
+    def name(self):
+        return _describe(self.oid)[1]
+
+    def __repr__(self):
+        return f"{self.name} = {_format_value(self.value)}"
+
+
+class Results:
+    """Compact results of SNMP commands.
+
+    OIDs are stored as tuples of ints and values as native Python values, in
+    parallel lists.  No pySNMP objects are kept alive, and names are only
+    resolved when asked for.  The first MAX_INTERNED_OIDS distinct OIDs seen
+    are interned, so OIDs polled over and over share one tuple; later ones are
+    not, and a long walk can not grow the table without bound.
+
+    errors holds (error_indication, error_text, object_id) tuples.
 
     """
-    errors = []
-    for error_indication, error_status, error_index, var_binds in results:
-        if error_indication or error_status:
-            error_text = error_status.prettyPrint() if error_status else error_status
-            object_id = var_binds[int(error_index) - 1][0] if error_index else "?"
-            errors.append((error_indication, error_text, object_id))
-    return errors
 
+    __slots__ = ("oids", "values", "errors")
 
-def _extract_values(results):
-    """Returns a dict of data values from the results."""
-    values = {}
-    for result in results:
-        var_binds = result[-1]
-        for var_bind in var_binds:
-            values[var_bind[0].prettyPrint()] = var_bind[1]
-    return values
+    _interned_oids = {}  # Shared by all Results.
+
+    def __init__(self):
+        self.oids = []
+        self.values = []
+        self.errors = []
+
+    @classmethod
+    def from_results(cls, results):
+        """Collects results from a pySNMP command iterator (or list) in one pass."""
+        collected = cls()
+        for result in results:
+            collected.add(*result)
+        return collected
+
+    def add(self, error_indication, error_status, error_index, var_binds):
+        """Adds one pySNMP command result."""
+        if error_indication or error_status:
+            error_text = error_status.prettyPrint() if error_status else error_status
+            object_id = (
+                _describe(self._oid(var_binds[int(error_index) - 1][0]))[0]
+                if error_index
+                else "?"
+            )
+            self.errors.append((error_indication, error_text, object_id))
+        interned_oids = self._interned_oids
+        for object_id, value in var_binds:
+            oid = self._oid(object_id)
+            interned = interned_oids.get(oid)
+            if interned is None:
+                interned = oid
+                if len(interned_oids) < MAX_INTERNED_OIDS:
+                    interned_oids[oid] = oid
+            self.oids.append(interned)
+            self.values.append(_native(value))
+
+    @staticmethod
+    def _oid(object_id):
+        """Returns an ObjectName or (resolved) ObjectIdentity as a tuple of ints."""
+        if hasattr(object_id, "getOid"):
+            object_id = object_id.getOid()
+        return tuple(object_id)
+
+    def __len__(self):
+        return len(self.oids)
+
+    def __getitem__(self, index):
+        if not -len(self.oids) <= index < len(self.oids):
+            raise IndexError("Results index out of range")
+        return ResultRow(self, index % len(self.oids))
+
+    def __iter__(self):
+        return (ResultRow(self, index) for index in range(len(self.oids)))
+
+    def as_dict(self):
+        """Returns a dict of MIB names to native values."""
+        return {_describe(oid)[1]: value for oid, value in zip(self.oids, self.values)}
+
+    def var_binds(self):
+        """Returns a list of (dotted OID, MIB name, value) strings."""
+        return [
+            _describe(oid) + (_format_value(value),)
+            for oid, value in zip(self.oids, self.values)
+        ]
 
 
 def _print_errors(errors):
@@ -81,13 +354,23 @@ def _print_errors(errors):
 def _print_values(values):
     """Prints object ids and their data values to the screen."""
     for object_id, value in values.items():
-        print(object_id, "=", value)
+        print(object_id, "=", _format_value(value))
 
 
-def _print_results(results):
-    """Prints the results of snmp commands and/or any related errors."""
-    _print_errors(_extract_errors(results))
-    _print_values(_extract_values(results))
+def _print_results(results, writer=None, source=""):
+    """Prints Results of snmp commands and/or any related errors.
+
+    Goes through the output.BufferedWriter if one is given.  A source, e.g. the
+    device name, is printed first.
+
+    """
+    if writer is None:
+        if source:
+            print(f"{source}:")
+        _print_errors(results.errors)
+        _print_values(results.as_dict())
+        return
+    writer.write_result(results.errors, results.var_binds(), source)
 
 
 def _old_print_results(command):
@@ -153,22 +436,42 @@ def common():
     _old_print_results(command)
 
 
-def temperature():
-    """One-Wire Temperature sensor on ControlByWeb X-410 module."""
+def temperature(user=None, key_cache=None, writer=None, devices=None):
+    """One-Wire Temperature sensor on ControlByWeb X-410 module.
+
+    Reads the devices (name -> serve configuration device dict, e.g. from
+    discover.x410_devices()) instead of the one module, if given.
+
+    """
     temp = _make_object("XYTRONIX-MIB", "temp", 0)
-    command = _make_get("192.168.0.132", "webrelay", temp)
-    results = _run_command(command)
-    _print_results(results)
+    if devices is None:
+        command = _make_get(
+            "192.168.0.132", "webrelay", temp, user=user, key_cache=key_cache
+        )
+        results = Results.from_results(command)
+        _print_results(results, writer)
+        return
+    for name, device in devices.items():
+        device_user = usm.make_user(**device["user"]) if device.get("user") else user
+        command = _make_get(
+            device["address"],
+            device.get("community", "webrelay"),
+            temp,
+            port=device.get("port", 161),
+            user=device_user,
+            key_cache=key_cache,
+        )
+        _print_results(Results.from_results(command), writer, name)
 
 
-def rewrite():
+def rewrite(writer=None):
     """PySNMP Tutorial Common Operations Example, rewritten"""
     sysDescr = _make_object("SNMPv2-MIB", "sysDescr", 0)
     sysUpTime = _make_object("SNMPv2-MIB", "sysUpTime", 0)
     ifInOctets = _make_object("IF-MIB", "ifInOctets", 1)
     command = _make_get("192.168.0.59", "public", sysDescr, sysUpTime, ifInOctets)
-    results = _run_command(command)
-    _print_results(results)
+    results = Results.from_results(command)
+    _print_results(results, writer)
 
 
 def _listen_callback(
@@ -182,15 +485,12 @@ def _listen_callback(
     transport_domain, transport_address = snmp_engine.msgAndPduDsp.getTransportInfo(
         state_reference
     )
-    print(
-        f"\nNotification from {transport_address}, "
-        f"SNMP Engine {context_engine_id.prettyPrint()}, "
-        f"Context {context_name.prettyPrint()}"
+    _writer.write_notification(
+        transport_address,
+        context_engine_id.prettyPrint(),
+        context_name.prettyPrint(),
+        [_describe(oid) + (value.prettyPrint(),) for oid, value in var_binds],
     )
-    for oid, value in var_binds:
-        name = rfc1902.ObjectIdentity(oid.prettyPrint())
-        name.resolveWithMib(_view_controller)
-        print(f"    {name.prettyPrint()} ({oid.prettyPrint()}) = {value.prettyPrint()}")
 
 
 def listen(
@@ -198,28 +498,45 @@ def listen(
     port=DEFAULT_PORT,
     community=DEFAULT_COMMUNITY,
     mibs=DEFAULT_MIBS,
+    user=None,
+    engine_ids=(),
+    key_cache_path=usm.DEFAULT_KEY_CACHE,
+    writer=None,
 ):
-    """Listen to and SNMP trap and print events."""
+    """Listen to and SNMP trap and print events.
+
+    If a usm.V3User is given, SNMPv3 traps from agents with the given engine IDs
+    and SNMPv3 informs are accepted too.
+    Notifications go through the output.BufferedWriter, if given.  With
+    structured formats, the status messages go to stderr instead of stdout.
+
+    """
     # Based on pySNMP example code.
-    mib_builder = builder.MibBuilder()
-    compiler.addMibCompiler(mib_builder)
-    mib_builder.loadModules(*mibs)
-    global _view_controller
-    _view_controller = view.MibViewController(mib_builder)
+    global _view_controller, _writer
+    _view_controller = _make_view_controller(mibs)
     loop = asyncio.get_event_loop()
+    _writer = writer if writer is not None else output.BufferedWriter()
+    _writer.schedule(loop)
+    status = sys.stdout if _writer.format == "text" else sys.stderr
     snmp_engine = engine.SnmpEngine()
-    print(f"Agent is listening SNMP Trap on {address}, Port: {port}")
+    print(f"Agent is listening SNMP Trap on {address}, Port: {port}", file=status)
     if port < 1024:
         print(
-            "WARNING: Port < 1024. Root priviledges or authbind required on *nix systems."
+            "WARNING: Port < 1024. Root priviledges or authbind required on *nix systems.",
+            file=status,
         )
-    print("-" * 79)
+    print("-" * 79, file=status)
     config.addTransport(
         snmp_engine,
         udp.domainName + (1,),
         udp.UdpTransport().openServerMode((address, port)),
     )
     config.addV1System(snmp_engine, community, community)
+    if user is not None:
+        usm.add_user(snmp_engine, user, usm.KeyCache(key_cache_path), engine_ids)
     ntfrcv.NotificationReceiver(snmp_engine, _listen_callback)
-    print("Press CTRL-C to quit.")
-    loop.run_forever()
+    print("Press CTRL-C to quit.", file=status, flush=True)
+    try:
+        loop.run_forever()
+    finally:
+        _writer.close()
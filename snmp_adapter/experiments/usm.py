@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""SNMPv3 User-based Security Model (USM) Experiments."""
+
+import collections
+import hashlib
+import json
+import os
+
+from pysnmp import hlapi
+from pysnmp.entity import config
+from pysnmp.proto import rfc1902
+
+DEFAULT_KEY_CACHE = "usm_keys.json"
+
+AUTH_PROTOCOLS = {
+    "NONE": config.usmNoAuthProtocol,
+    "MD5": config.usmHMACMD5AuthProtocol,
+    "SHA": config.usmHMACSHAAuthProtocol,
+    "SHA224": config.usmHMAC128SHA224AuthProtocol,
+    "SHA256": config.usmHMAC192SHA256AuthProtocol,
+    "SHA384": config.usmHMAC256SHA384AuthProtocol,
+    "SHA512": config.usmHMAC384SHA512AuthProtocol,
+}
+PRIV_PROTOCOLS = {
+    "NONE": config.usmNoPrivProtocol,
+    "DES": config.usmDESPrivProtocol,
+    "3DES": config.usm3DESEDEPrivProtocol,
+    "AES": config.usmAesCfb128Protocol,
+    "AES192": config.usmAesCfb192Protocol,
+    "AES256": config.usmAesCfb256Protocol,
+}
+
+# Keys are pass phrases, protocols are names from AUTH_PROTOCOLS and PRIV_PROTOCOLS.
+V3User = collections.namedtuple(
+    "V3User", "name auth_key priv_key auth_protocol priv_protocol"
+)
+
+
+def make_user(
+    name, auth_key=None, priv_key=None, auth_protocol=None, priv_protocol=None
+):
+    """Returns a V3User, picking sensible protocols for the keys given."""
+    if auth_protocol is None:
+        auth_protocol = "SHA" if auth_key else "NONE"
+    if priv_protocol is None:
+        priv_protocol = "AES" if priv_key else "NONE"
+    return V3User(
+        name, auth_key, priv_key, auth_protocol.upper(), priv_protocol.upper()
+    )
+
+
+class KeyCache:
+    """Persistent cache of USM keys derived from user pass phrases.
+
+    Turning a pass phrase into a master key hashes a megabyte of data, which is
+    what makes naive SNMPv3 setups slow to start.  Localizing a master key to an
+    engine ID is cheap, but is cached too so known engines need no hashing at all.
+
+    Entries are keyed by (user, engine ID, protocols) plus a salted fingerprint
+    of the pass phrases, so changing a pass phrase invalidates them.
+    The engine ID is empty for master keys.
+
+    """
+
+    def __init__(self, path=DEFAULT_KEY_CACHE):
+        self.path = path
+        self._dirty = False
+        try:
+            with open(path) as cache_file:
+                data = json.load(cache_file)
+        except FileNotFoundError:
+            data = {"salt": os.urandom(16).hex(), "keys": {}}
+            self._dirty = True
+        self._salt = bytes.fromhex(data["salt"])
+        self._keys = data["keys"]
+
+    def _entry_key(self, user, engine_id):
+        fingerprint = hashlib.sha256(self._salt)
+        for secret in (user.auth_key, user.priv_key):
+            fingerprint.update((secret or "").encode() + b"\0")
+        return "|".join(
+            (
+                user.name,
+                engine_id,
+                user.auth_protocol,
+                user.priv_protocol,
+                fingerprint.hexdigest()[:16],
+            )
+        )
+
+    def _get(self, user, engine_id, derive):
+        entry_key = self._entry_key(user, engine_id)
+        keys = self._keys.get(entry_key)
+        if keys is None:
+            keys = [key.hex() if key is not None else None for key in derive()]
+            self._keys[entry_key] = keys
+            self._dirty = True
+        return tuple(bytes.fromhex(key) if key is not None else None for key in keys)
+
+    def master_keys(self, user):
+        """Returns the (auth, priv) master keys for the user."""
+
+        def derive():
+            auth_protocol = AUTH_PROTOCOLS[user.auth_protocol]
+            priv_protocol = PRIV_PROTOCOLS[user.priv_protocol]
+            auth_key = priv_key = None
+            if user.auth_key:
+                auth_service = config.authServices[auth_protocol]
+                auth_key = bytes(auth_service.hashPassphrase(user.auth_key))
+            if user.priv_key:
+                priv_service = config.privServices[priv_protocol]
+                priv_key = bytes(
+                    priv_service.hashPassphrase(auth_protocol, user.priv_key)
+                )
+            return auth_key, priv_key
+
+        return self._get(user, "", derive)
+
+    def localized_keys(self, user, engine_id):
+        """Returns the (auth, priv) keys for the user localized to engine_id (hex)."""
+
+        def derive():
+            auth_protocol = AUTH_PROTOCOLS[user.auth_protocol]
+            priv_protocol = PRIV_PROTOCOLS[user.priv_protocol]
+            master_auth_key, master_priv_key = self.master_keys(user)
+            engine = rfc1902.OctetString(hexValue=engine_id)
+            auth_key = priv_key = None
+            if master_auth_key:
+                auth_service = config.authServices[auth_protocol]
+                auth_key = bytes(auth_service.localizeKey(master_auth_key, engine))
+            if master_priv_key:
+                priv_service = config.privServices[priv_protocol]
+                priv_key = bytes(
+                    priv_service.localizeKey(auth_protocol, master_priv_key, engine)
+                )
+            return auth_key, priv_key
+
+        return self._get(user, engine_id.lower(), derive)
+
+    def save(self):
+        """Writes the cache back to disk if anything changed.  Keys are secrets."""
+        if not self._dirty:
+            return
+        data = {"salt": self._salt.hex(), "keys": self._keys}
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(descriptor, 0o600)  # O_CREAT's mode only applies to new files.
+        with os.fdopen(descriptor, "w") as cache_file:
+            json.dump(data, cache_file, indent=1)
+        self._dirty = False
+
+
+def add_user(snmp_engine, user, key_cache, engine_ids=()):
+    """Configure a V3 user on a (low-level) SNMP engine, e.g. a trap receiver.
+
+    SNMPv3 traps are authenticated with keys localized to the sending agent's
+    engine ID, so one entry is added per known agent engine_id (hex strings).
+    Another entry using the local engine ID is added for informs.
+
+    """
+    auth_protocol = AUTH_PROTOCOLS[user.auth_protocol]
+    priv_protocol = PRIV_PROTOCOLS[user.priv_protocol]
+    auth_key, priv_key = key_cache.master_keys(user)
+    config.addV3User(
+        snmp_engine,
+        user.name,
+        auth_protocol,
+        auth_key,
+        priv_protocol,
+        priv_key,
+        authKeyType=config.usmKeyTypeMaster,
+        privKeyType=config.usmKeyTypeMaster,
+    )
+    for engine_id in engine_ids:
+        auth_key, priv_key = key_cache.localized_keys(user, engine_id)
+        config.addV3User(
+            snmp_engine,
+            user.name,
+            auth_protocol,
+            auth_key,
+            priv_protocol,
+            priv_key,
+            securityEngineId=rfc1902.OctetString(hexValue=engine_id),
+            authKeyType=config.usmKeyTypeLocalized,
+            privKeyType=config.usmKeyTypeLocalized,
+        )
+    key_cache.save()
+
+
+def remove_user(snmp_engine, name, engine_ids=()):
+    """Removes a V3 user added with add_user(), and the entries derived from it."""
+    config.delV3User(snmp_engine, name)
+    for engine_id in engine_ids:
+        config.delV3User(
+            snmp_engine,
+            name,
+            securityEngineId=rfc1902.OctetString(hexValue=engine_id),
+        )
+
+
+def make_auth_data(user, key_cache):
+    """Returns hlapi UsmUserData for a command generator (poller).
+
+    Master keys are passed in, so discovering a new agent only localizes them.
+
+    """
+    auth_key, priv_key = key_cache.master_keys(user)
+    key_cache.save()
+    return hlapi.UsmUserData(
+        user.name,
+        authKey=auth_key,
+        privKey=priv_key,
+        authProtocol=AUTH_PROTOCOLS[user.auth_protocol],
+        privProtocol=PRIV_PROTOCOLS[user.priv_protocol],
+        authKeyType=config.usmKeyTypeMaster,
+        privKeyType=config.usmKeyTypeMaster,
+    )
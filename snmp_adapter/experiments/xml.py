@@ -3,6 +3,7 @@
 """XML Experiments."""
 
 from datetime import datetime, timezone
+from xml.etree import ElementTree
 
 import yattag
 
@@ -21,6 +22,11 @@ def _words(words):
     return doc.getvalue()
 
 
+def _read_words(document):
+    """Returns the list of words in an XML document from _words()."""
+    return [word.text or "" for word in ElementTree.fromstring(document).iter("word")]
+
+
 def words(words):
     """Prints an XML document of all the words in the given text."""
     raw_output = _words(words)
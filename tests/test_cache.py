@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cache.ValueCache`."""
+
+import asyncio
+import gc
+
+import pytest
+
+from snmp_adapter.experiments import cache
+
+TEMP = (1, 3, 6, 1, 4, 1, 30586, 46, 0, 11, 0)
+VIN = (1, 3, 6, 1, 4, 1, 30586, 46, 0, 12, 0)
+
+
+@pytest.fixture
+def loop():
+    """An event loop that fails the test on unhandled exceptions."""
+    loop = asyncio.new_event_loop()
+    unhandled = []
+    loop.set_exception_handler(lambda loop, context: unhandled.append(context))
+    yield loop
+    gc.collect()  # Unretrieved future exceptions are reported when collected.
+    loop.close()
+    assert unhandled == []
+
+
+class Fetcher:
+    """A fetch() that records its calls and answers after a loop iteration."""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    async def __call__(self, oids):
+        self.calls.append(list(oids))
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        return {oid: oid[-2] for oid in oids}
+
+
+def test_get_caches(loop):
+    value_cache = cache.ValueCache()
+    fetch = Fetcher()
+    values = loop.run_until_complete(value_cache.get("x410", [TEMP, VIN], fetch))
+    assert values == {TEMP: 11, VIN: 12}
+    values = loop.run_until_complete(value_cache.get("x410", [TEMP], fetch))
+    assert values == {TEMP: 11}
+    assert fetch.calls == [[TEMP, VIN]]
+
+
+def test_get_expired(loop):
+    value_cache = cache.ValueCache(default_ttl=0)
+    fetch = Fetcher()
+    loop.run_until_complete(value_cache.get("x410", [TEMP], fetch))
+    loop.run_until_complete(value_cache.get("x410", [TEMP], fetch))
+    assert fetch.calls == [[TEMP], [TEMP]]
+
+
+def test_get_duplicate_oids(loop):
+    value_cache = cache.ValueCache()
+    fetch = Fetcher()
+    values = loop.run_until_complete(value_cache.get("x410", [TEMP, TEMP], fetch))
+    assert values == {TEMP: 11}
+    assert fetch.calls == [[TEMP]]
+    assert value_cache._in_flight == {}
+
+
+def test_get_shared(loop):
+    value_cache = cache.ValueCache()
+    fetch = Fetcher()
+    gets = asyncio.gather(
+        value_cache.get("x410", [TEMP], fetch),
+        value_cache.get("x410", [TEMP, VIN], fetch),
+        loop=loop,
+    )
+    assert loop.run_until_complete(gets) == [{TEMP: 11}, {TEMP: 11, VIN: 12}]
+    assert fetch.calls == [[TEMP], [VIN]]
+
+
+def test_get_failed_fetch(loop):
+    value_cache = cache.ValueCache()
+    fetch = Fetcher(cache.FetchError("timeout"))
+
+    async def get(oids):
+        try:
+            await value_cache.get("x410", oids, fetch)
+        except cache.FetchError as exception:
+            return str(exception)
+
+    gets = asyncio.gather(get([TEMP, VIN]), get([VIN, TEMP]), get([TEMP]), loop=loop)
+    assert loop.run_until_complete(gets) == ["timeout"] * 3
+    assert fetch.calls == [[TEMP, VIN]]
+    assert value_cache._in_flight == {}
+    # Nothing cached, the next get() tries again.
+    fetch.error = None
+    values = loop.run_until_complete(value_cache.get("x410", [TEMP], fetch))
+    assert values == {TEMP: 11}
+
+
+def test_ttl_prefix():
+    value_cache = cache.ValueCache(default_ttl=1.0)
+    value_cache.set_ttl(TEMP[:-2], 5.0)
+    value_cache.set_ttl(TEMP, 10.0)
+    assert value_cache.ttl(TEMP) == 10.0
+    assert value_cache.ttl(VIN) == 5.0
+    assert value_cache.ttl((1, 3, 6, 1, 2, 1, 1, 3, 0)) == 1.0
+    value_cache.clear_ttls()
+    assert value_cache.ttl(TEMP) == 1.0
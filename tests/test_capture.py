@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the pcap reading and trap decoding in `capture`."""
+
+import struct
+
+import pytest
+from pyasn1.codec.ber import encoder
+from pysnmp.proto import api
+
+from snmp_adapter.experiments import capture, snmp
+
+
+def _cold_start():
+    """Returns an SNMPv1 coldStart trap datagram, without var binds."""
+    p_mod = api.protoModules[api.protoVersion1]
+    pdu = p_mod.TrapPDU()
+    p_mod.apiTrapPDU.setDefaults(pdu)
+    message = p_mod.Message()
+    p_mod.apiMessage.setDefaults(message)
+    p_mod.apiMessage.setCommunity(message, "public")
+    p_mod.apiMessage.setPDU(message, pdu)
+    return encoder.encode(message)
+
+
+def _ipv4_udp(source, port, payload):
+    """Returns a raw IPv4 packet carrying a UDP datagram.  Checksums are zero."""
+    udp = struct.pack("!HHHH", 50000, port, 8 + len(payload), 0) + payload
+    ip = struct.pack(
+        "!BBHHHBBH4s4s",
+        0x45,
+        0,
+        20 + len(udp),
+        0,
+        0,
+        64,
+        17,
+        0,
+        bytes(source),
+        bytes((127, 0, 0, 1)),
+    )
+    return ip + udp
+
+
+@pytest.fixture
+def pcap(tmp_path):
+    """A little-endian raw IP pcap file: a trap, a datagram to another port."""
+    path = tmp_path / "traps.pcap"
+    records = [
+        (1606435200, 500000, _ipv4_udp((192, 168, 0, 132), 162, _cold_start())),
+        (1606435201, 0, _ipv4_udp((192, 168, 0, 59), 161, b"not a trap")),
+    ]
+    with open(path, "wb") as pcap_file:
+        pcap_file.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 101))
+        for seconds, fraction, packet in records:
+            pcap_file.write(
+                struct.pack("<IIII", seconds, fraction, len(packet), len(packet))
+            )
+            pcap_file.write(packet)
+    return path
+
+
+def test_read_pcap(pcap):
+    datagrams = list(capture._read_pcap(pcap, 162))
+    assert datagrams == [(1606435200.5, "192.168.0.132", _cold_start())]
+
+
+def test_read_pcap_other_port(pcap):
+    datagrams = list(capture._read_pcap(pcap, 161))
+    assert [source for _, source, _ in datagrams] == ["192.168.0.59"]
+
+
+def test_read_pcap_not_pcap(tmp_path):
+    path = tmp_path / "not.pcap"
+    path.write_bytes(b"\0" * 24)
+    with pytest.raises(ValueError):
+        list(capture._read_pcap(path))
+
+
+def test_decode_trap_without_var_binds(pcap):
+    snmp._get_view_controller()  # What _init_worker() does in the workers.
+    rows, errors = capture._decode_batch(capture._read_pcap(pcap, 162))
+    assert errors == 0
+    assert len(rows) == 1
+    assert rows[0]["source"] == "192.168.0.132"
+    assert rows[0]["notification"] == "SNMPv2-MIB::coldStart"
+    assert rows[0]["oid"] == ""
+    assert rows[0]["value"] is None
+
+
+def test_decode_undecodable():
+    rows, errors = capture._decode_batch([(0.0, "192.168.0.1", b"\x30\x03junk")])
+    assert (rows, errors) == ([], 1)
+
+
+@pytest.mark.parametrize(
+    "link_type, link_header",
+    [
+        (capture._LINKTYPE_RAW, b""),
+        (capture._LINKTYPE_ETHERNET, b"\0" * 12 + b"\x81\x00\0\0" + b"\x08\x00"),
+        (capture._LINKTYPE_LINUX_SLL, b"\0" * 16),
+    ],
+)
+def test_udp_payload_truncated(link_type, link_header):
+    frame = link_header + _ipv4_udp((192, 168, 0, 132), 162, _cold_start())
+    assert capture._udp_payload(frame, link_type, 162)[1] == _cold_start()
+    for length in range(len(frame)):
+        assert capture._udp_payload(frame[:length], link_type, 162) is None
+
+
+def test_read_pcap_truncated_record(pcap):
+    packet = _ipv4_udp((192, 168, 0, 133), 162, _cold_start())
+    with open(pcap, "ab") as pcap_file:
+        # Claims more than is left in the file.
+        pcap_file.write(struct.pack("<IIII", 1606435202, 0, len(packet), len(packet)))
+        pcap_file.write(packet[:30])
+    datagrams = list(capture._read_pcap(pcap, 162))
+    assert [source for _, source, _ in datagrams] == ["192.168.0.132"]
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the SNMP SETs in `control`."""
+
+import asyncio
+
+import pytest
+from pysnmp.hlapi import asyncio as hlapi_asyncio
+from pysnmp.proto import errind
+
+from snmp_adapter.experiments import control
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("relay1=1", (("XYTRONIX-MIB", "relay1", 0), "1")),
+        ("relay2PulseTimer=1.5", (("XYTRONIX-MIB", "relay2PulseTimer", 0), "1.5")),
+        ("SNMPv2-MIB::sysContact.0=me", (("SNMPv2-MIB", "sysContact", 0), "me")),
+        ("IF-MIB::ifAlias.2=a=b", (("IF-MIB", "ifAlias", 2), "a=b")),
+        (" relay1 =0", (("XYTRONIX-MIB", "relay1", 0), "0")),
+    ],
+)
+def test_parse_setting(text, expected):
+    assert control.parse_setting(text) == expected
+
+
+@pytest.mark.parametrize("text", ["relay1", "relay1.x=1"])
+def test_parse_setting_invalid(text):
+    with pytest.raises(ValueError):
+        control.parse_setting(text)
+
+
+@pytest.mark.parametrize(
+    "text", ["relay9=1", "SNMPv2-MIB::sysServices=abc", "SNMPv2-MIB::sysServices=1000"]
+)
+def test_make_setting_invalid(text):
+    with pytest.raises(ValueError):
+        control.make_setting(*control.parse_setting(text))
+
+
+def _set_device(monkeypatch, get_result, text="relay1=1"):
+    """Runs set_device() with a SET that succeeds and a read-back of get_result.
+
+    get_result is called with the setting from text and returns the GET's result.
+
+    """
+
+    async def request(command, snmp_engine, auth_data, target, var_binds, device):
+        if command is hlapi_asyncio.setCmd:
+            return (None, 0, 0, list(var_binds)), 0.01
+        return get_result(setting), 0.01
+
+    monkeypatch.setattr(control, "_request", request)
+    setting = control.make_setting(*control.parse_setting(text))
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            control.set_device(None, None, "192.0.2.10", [setting])
+        )
+    finally:
+        loop.close()
+
+
+def test_set_device_confirmed(monkeypatch):
+    result = _set_device(
+        monkeypatch,
+        lambda setting: (None, 0, 0, [(setting[0], setting[1].clone("1"))]),
+    )
+    assert control.confirmed(result)
+    assert "confirmed" in control._describe_result(result)
+
+
+def test_set_device_mismatch(monkeypatch):
+    result = _set_device(
+        monkeypatch,
+        lambda setting: (None, 0, 0, [(setting[0], setting[1].clone("0"))]),
+    )
+    assert not control.confirmed(result)
+    assert result.mismatches
+    assert "mismatch" in control._describe_result(result)
+
+
+def test_set_device_read_back_timeout(monkeypatch):
+    result = _set_device(
+        monkeypatch, lambda setting: (errind.RequestTimedOut(), 0, 0, [])
+    )
+    assert not control.confirmed(result)
+    assert "read back failed" in control._describe_result(result)
+
+
+@pytest.mark.parametrize(
+    "text, read_back, expected",
+    [
+        ("relay1=2", "0", True),  # Pulsed, and the pulse is over.
+        ("relay1=2", "1", True),
+        ("relay1=2", "2", False),
+        ("relay1=0", "1", False),
+        ("relay2PulseTimer=1.5", "1.50", True),
+        ("relay2PulseTimer=1.5", "1.5", True),
+        ("relay2PulseTimer=1.5", "2", False),
+        ("relay2PulseTimer=1.5", "", False),
+        ("SNMPv2-MIB::sysContact.0=2", "2.0", False),
+    ],
+)
+def test_set_device_read_back(monkeypatch, text, read_back, expected):
+    result = _set_device(
+        monkeypatch,
+        lambda setting: (None, 0, 0, [(setting[0], setting[1].clone(read_back))]),
+        text,
+    )
+    assert control.confirmed(result) == expected
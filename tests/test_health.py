@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `health.DeviceHealth` and the health tracking of snmp commands."""
+
+import pytest
+from pysnmp.proto import errind
+
+from snmp_adapter.experiments import health, snmp
+
+
+def _fail(device, count, now=0.0):
+    for _ in range(count):
+        device.record_failure(now)
+
+
+def test_initial_timeout():
+    device = health.DeviceHealth()
+    assert device.timeout() == health.INITIAL_TIMEOUT
+    assert device.allow()
+    assert not device.is_down
+
+
+def test_timeout_follows_rtt():
+    device = health.DeviceHealth()
+    device.record_success(0.2)
+    assert device.srtt == 0.2
+    assert device.rttvar == 0.1
+    assert device.rto == pytest.approx(0.6)
+    assert device.timeout() == health.MIN_TIMEOUT
+    device.record_success(1.0)
+    assert device.srtt == pytest.approx(0.3)
+    assert device.rttvar == pytest.approx(0.275)
+    assert device.timeout() == 1.5  # 1.4, rounded to a quarter second.
+
+
+def test_backoff_and_reset():
+    device = health.DeviceHealth()
+    device.record_success(0.5)
+    _fail(device, 2)
+    assert device.rto == pytest.approx(4 * 1.5)
+    assert not device.is_down
+    device.record_success()  # Retried, no RTT sample.
+    assert device.rto == pytest.approx(1.5)
+    assert device.failures == 0
+
+
+def test_timeout_bounds():
+    device = health.DeviceHealth()
+    device.record_success(0.001)
+    assert device.timeout() == health.MIN_TIMEOUT
+    _fail(device, 20)
+    assert device.timeout() == health.MAX_TIMEOUT
+
+
+def test_circuit_breaker():
+    device = health.DeviceHealth()
+    _fail(device, health.FAILURE_THRESHOLD - 1, now=100.0)
+    assert not device.is_down
+    device.record_failure(100.0)
+    assert device.is_down
+    assert device.down_since == 100.0
+    assert not device.allow(100.0)
+    assert not device.allow(100.0 + health.PROBE_INTERVAL - 1)
+    # One probe per interval.
+    assert device.allow(100.0 + health.PROBE_INTERVAL)
+    assert not device.allow(100.0 + health.PROBE_INTERVAL)
+    # A failed probe doubles the interval.
+    device.record_failure(130.0)
+    assert device.probe_interval == 2 * health.PROBE_INTERVAL
+    assert not device.allow(130.0 + health.PROBE_INTERVAL)
+    assert device.allow(130.0 + 2 * health.PROBE_INTERVAL)
+    # A successful probe brings it back up.
+    device.record_success(0.1)
+    assert not device.is_down
+    assert device.allow(0.0)
+    assert device.probe_interval == health.PROBE_INTERVAL
+
+
+def test_probe_interval_bound():
+    device = health.DeviceHealth()
+    _fail(device, 50)
+    assert device.probe_interval == health.MAX_PROBE_INTERVAL
+
+
+def test_get_is_per_device():
+    assert health.get("192.0.2.1") is health.get("192.0.2.1", 161)
+    assert health.get("192.0.2.1") is not health.get("192.0.2.1", 1161)
+
+
+def _command(*error_indications):
+    """A pySNMP command iterator with one result per error indication."""
+    for error_indication in error_indications:
+        yield (error_indication, 0, 0, [])
+
+
+def test_track_health_success():
+    device = health.DeviceHealth()
+    results = list(snmp._track_health(_command(None), device, "x:161"))
+    assert results == [(None, 0, 0, [])]
+    assert device.srtt is not None
+
+
+def test_track_health_trips_breaker_once():
+    device = health.DeviceHealth()
+    for _ in range(health.FAILURE_THRESHOLD):
+        timeout = errind.RequestTimedOut()
+        results = list(snmp._track_health(_command(timeout), device, "x:161"))
+        # The real timeout only, not also a skipped request.
+        assert results == [(timeout, 0, 0, [])]
+    assert device.is_down
+    results = list(snmp._track_health(_command(None), device, "x:161"))
+    assert results == [("x:161 is down, request skipped", 0, 0, [])]
+    assert device.is_down
+
+
+def test_track_health_failed_probe():
+    device = health.DeviceHealth()
+    _fail(device, health.FAILURE_THRESHOLD)
+    device.next_probe = 0.0  # Probe due.
+    timeout = errind.RequestTimedOut()
+    results = list(snmp._track_health(_command(timeout), device, "x:161"))
+    assert results == [(timeout, 0, 0, [])]
+
+
+def test_track_health_walk_runs_to_end():
+    device = health.DeviceHealth()
+    _fail(device, health.FAILURE_THRESHOLD - 1)
+    timeout = errind.RequestTimedOut()
+    command = _command(None, timeout, None)
+    results = list(snmp._track_health(command, device, "x:161"))
+    assert [result[0] for result in results] == [None, timeout, None]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `history.TrapHistory`."""
+
+import pytest
+
+from snmp_adapter.experiments import history
+
+RELAY1 = (1, 3, 6, 1, 4, 1, 30586, 46, 100, 0, 5)
+RELAY2 = (1, 3, 6, 1, 4, 1, 30586, 46, 100, 0, 6)
+UPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+
+
+def _var_binds(index):
+    return [(UPTIME, index), ((1, 3, 6, 1, 4, 1, 30586, 46, 0, 5, 0), "1")]
+
+
+@pytest.fixture
+def traps():
+    """Ten traps, one a second from t=100, alternating sources and notifications."""
+    trap_history = history.TrapHistory(max_records=100, max_age=None)
+    for index in range(10):
+        trap_history.add(
+            f"192.168.0.{index % 2}",
+            RELAY1 if index % 3 else RELAY2,
+            _var_binds(index),
+            now=100.0 + index,
+        )
+    return trap_history
+
+
+def test_query_all(traps):
+    records = traps.query()
+    assert len(traps) == len(records) == 10
+    assert [record.time for record in records] == [100.0 + i for i in range(10)]
+    assert records[3] == history.TrapRecord(103.0, "192.168.0.1", RELAY2, _var_binds(3))
+
+
+def test_query_time_range(traps):
+    records = traps.query(start=102.0, end=105.0)
+    assert [record.time for record in records] == [102.0, 103.0, 104.0]
+    assert traps.query(start=200.0) == []
+
+
+def test_query_source(traps):
+    records = traps.query(source="192.168.0.1", start=103.0)
+    assert [record.time for record in records] == [103.0, 105.0, 107.0, 109.0]
+    assert traps.query(source="10.0.0.1") == []
+
+
+def test_query_notification(traps):
+    records = traps.query(notification=RELAY2)
+    assert [record.time for record in records] == [100.0, 103.0, 106.0, 109.0]
+    assert traps.query(notification=(1, 2, 3)) == []
+
+
+def test_query_source_and_notification(traps):
+    records = traps.query(source="192.168.0.0", notification=RELAY2, end=109.0)
+    assert [record.time for record in records] == [100.0, 106.0]
+
+
+def test_query_limit(traps):
+    records = traps.query(source="192.168.0.0", limit=2)
+    assert [record.time for record in records] == [106.0, 108.0]
+    assert len(traps.query(limit=20)) == 10
+
+
+def test_max_records():
+    trap_history = history.TrapHistory(max_records=4, max_age=None)
+    for index in range(10):
+        trap_history.add("192.168.0.1", RELAY1, _var_binds(index), now=float(index))
+    assert len(trap_history) == 4
+    records = trap_history.query()
+    assert [record.time for record in records] == [6.0, 7.0, 8.0, 9.0]
+    assert [record.var_binds[0][1] for record in records] == [6, 7, 8, 9]
+    assert len(trap_history.query(source="192.168.0.1")) == 4
+
+
+def test_max_age():
+    trap_history = history.TrapHistory(max_records=100, max_age=10.0)
+    trap_history.add("192.168.0.1", RELAY1, [], now=0.0)
+    trap_history.add("192.168.0.2", RELAY2, [], now=5.0)
+    trap_history.add("192.168.0.2", RELAY2, [], now=12.0)
+    assert [record.time for record in trap_history.query()] == [5.0, 12.0]
+    assert trap_history.sources() == ["192.168.0.2"]
+    assert trap_history.notifications() == [RELAY2]
+
+
+def test_clock_going_backwards():
+    trap_history = history.TrapHistory(max_age=None)
+    trap_history.add("192.168.0.1", RELAY1, [], now=10.0)
+    trap_history.add("192.168.0.1", RELAY1, [], now=5.0)
+    assert [record.time for record in trap_history.query()] == [10.0, 10.0]
+
+
+def test_values_round_trip():
+    values = [
+        None,
+        -(2**63),
+        2**64,  # Too large for the packed integers.
+        "température",
+        b"\x00\xff",
+        (1, 3, 6, 1, 4, 1, 30586),
+    ]
+    var_binds = [((1, 3, 6, 1, index), value) for index, value in enumerate(values)]
+    trap_history = history.TrapHistory()
+    trap_history.add("192.168.0.1", RELAY1, var_binds)
+    (record,) = trap_history.query()
+    assert record.var_binds[:2] + record.var_binds[3:] == (
+        var_binds[:2] + var_binds[3:]
+    )
+    assert record.var_binds[2] == ((1, 3, 6, 1, 2), str(2**64))
+
+
+@pytest.mark.parametrize(
+    "max_records, max_age", [(0, None), (-1, None), (10, -1.0), (0, 10.0)]
+)
+def test_invalid_limits(max_records, max_age):
+    with pytest.raises(ValueError):
+        history.TrapHistory(max_records, max_age)
+
+
+def test_single_record():
+    trap_history = history.TrapHistory(max_records=1, max_age=0)
+    trap_history.add("192.168.0.1", RELAY1, [], now=1.0)
+    trap_history.add("192.168.0.2", RELAY2, [], now=2.0)
+    assert [record.source for record in trap_history.query()] == ["192.168.0.2"]
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the `output.BufferedWriter` formats."""
+
+import csv
+import io
+import json
+
+import pytest
+
+from snmp_adapter.experiments import output
+
+VAR_BINDS = [
+    ("1.3.6.1.2.1.1.3.0", "SNMPv2-MIB::sysUpTime.0", "42"),
+    ("1.3.6.1.4.1.30586.46.0.5.0", "XYTRONIX-MIB::relay1.0", 'say "NI", 1'),
+]
+ERRORS = [("", "noSuchName", "SNMPv2-MIB::sysDescr.0")]
+
+
+def _writer(format, **kwargs):
+    stream = io.BytesIO()
+    kwargs.setdefault("max_delay", 3600)
+    return output.BufferedWriter(format, stream, **kwargs), stream
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        output.BufferedWriter("xml", io.BytesIO())
+
+
+def test_text_result():
+    writer, stream = _writer("text")
+    writer.write_result(ERRORS, VAR_BINDS)
+    writer.close()
+    assert stream.getvalue().decode() == (
+        "noSuchName at SNMPv2-MIB::sysDescr.0\n"
+        "SNMPv2-MIB::sysUpTime.0 = 42\n"
+        'XYTRONIX-MIB::relay1.0 = say "NI", 1\n'
+    )
+
+
+def test_text_result_source():
+    writer, stream = _writer("text")
+    writer.write_result([], VAR_BINDS[:1], "x410")
+    writer.close()
+    assert stream.getvalue().decode() == "x410:\nSNMPv2-MIB::sysUpTime.0 = 42\n"
+
+
+def test_text_notification():
+    writer, stream = _writer("text")
+    writer.write_notification(("192.168.0.132", 162), "0x80", "", VAR_BINDS[:1])
+    writer.close()
+    assert stream.getvalue().decode() == (
+        "\nNotification from ('192.168.0.132', 162), SNMP Engine 0x80, Context \n"
+        "    SNMPv2-MIB::sysUpTime.0 (1.3.6.1.2.1.1.3.0) = 42\n"
+    )
+
+
+def test_ndjson():
+    writer, stream = _writer("ndjson")
+    writer.write_result(ERRORS, VAR_BINDS, "x410")
+    writer.write_notification(("192.168.0.132", 162), "0x80", "", VAR_BINDS)
+    writer.close()
+    result, notification = [
+        json.loads(line) for line in stream.getvalue().decode().splitlines()
+    ]
+    assert result["type"] == "result"
+    assert result["source"] == "x410"
+    assert result["errors"] == [
+        {"indication": "", "status": "noSuchName", "oid": "SNMPv2-MIB::sysDescr.0"}
+    ]
+    assert [var_bind["value"] for var_bind in result["var_binds"]] == [
+        "42",
+        'say "NI", 1',
+    ]
+    assert notification["type"] == "notification"
+    assert notification["source"] == "192.168.0.132:162"
+    assert len(notification["var_binds"]) == 2
+
+
+def test_csv():
+    writer, stream = _writer("csv")
+    writer.write_result(ERRORS, VAR_BINDS, "x410")
+    writer.close()
+    rows = list(csv.reader(io.StringIO(stream.getvalue().decode())))
+    assert rows[0] == list(output._CSV_HEADER)
+    assert [row[0] for row in rows[1:]] == ["error", "result", "result"]
+    assert rows[1][3:] == ["SNMPv2-MIB::sysDescr.0", "", "noSuchName"]
+    assert rows[3][2:] == ["x410", *VAR_BINDS[1]]
+
+
+def test_buffered_until_max_size():
+    writer, stream = _writer("text", max_size=100)
+    writer.write_result([], VAR_BINDS[:1])
+    assert stream.getvalue() == b""
+    writer.write_result([], VAR_BINDS * 2)
+    assert stream.getvalue().count(b"\n") == 5
+    writer.write_result([], VAR_BINDS[:1])
+    assert stream.getvalue().count(b"\n") == 5
+    writer.flush()
+    assert stream.getvalue().count(b"\n") == 6
+
+
+def test_max_delay():
+    writer, stream = _writer("text", max_delay=0)
+    writer.write_result([], VAR_BINDS[:1])
+    assert stream.getvalue() == b"SNMPv2-MIB::sysUpTime.0 = 42\n"
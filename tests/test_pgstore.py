@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `pgstore.PartitionedStore`.
+
+Most need a PostgreSQL 11+ database to write to, given as an SQLAlchemy URL
+in SNMP_ADAPTER_PG_URL, e.g. postgresql://user@/test, and are skipped when it
+is unset.
+
+"""
+
+import os
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+import sqlalchemy as sa
+
+from snmp_adapter.experiments import pgstore
+
+DATABASE = os.environ.get("SNMP_ADAPTER_PG_URL")
+
+
+@pytest.fixture
+def store():
+    if not DATABASE:
+        pytest.skip("SNMP_ADAPTER_PG_URL is not set")
+    table = f"test_traps_{uuid.uuid4().hex[:8]}"
+    store = pgstore.PartitionedStore(DATABASE, table, batch_size=3)
+    store.create()
+    yield store
+    with store.engine.begin() as conn:
+        conn.execute(sa.text(f"DROP TABLE IF EXISTS {table}"))
+    store.engine.dispose()
+
+
+def _row(day, hour, value="1"):
+    return dict(
+        timestamp=datetime(2020, 11, day, hour, tzinfo=timezone.utc),
+        source="192.168.0.132",
+        notification="XYTRONIX-MIB::relay1Notification",
+        oid="1.3.6.1.4.1.30586.46.0.5.0",
+        name="XYTRONIX-MIB::relay1.0",
+        value=value,
+    )
+
+
+def _values(store):
+    with store.engine.connect() as conn:
+        rows = conn.execute(
+            sa.text(f"SELECT timestamp, value FROM {store.table} ORDER BY timestamp")
+        )
+        # Back in the session's time zone.
+        return [
+            (timestamp.astimezone(timezone.utc).day, value) for timestamp, value in rows
+        ]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, "\\N"),
+        ("a\tb\nc\rd\\N", "a\\tb\\nc\\rd\\\\N"),
+        (datetime(2020, 11, 26, 23, 30), "2020-11-26T23:30:00+00:00"),
+        (
+            datetime(2020, 11, 26, 23, 30, tzinfo=timezone(timedelta(hours=-5))),
+            "2020-11-26T23:30:00-05:00",
+        ),
+    ],
+)
+def test_copy_field(value, expected):
+    assert pgstore._copy_field(value) == expected
+
+
+def test_create(store):
+    assert store.partitions() == {}
+    store.create()  # Twice is fine.
+    assert store.partitions() == {}
+
+
+def test_write_two_days(store):
+    assert store.write([_row(26, 10), _row(26, 23)]) == 0
+    assert _values(store) == []
+    assert store.write([_row(27, 0, value="0")]) == 3
+    assert store.write([_row(27, 1, value=None)]) == 0
+    assert store.flush() == 1
+    assert store.flush() == 0
+    assert _values(store) == [(26, "1"), (26, "1"), (27, "0"), (27, None)]
+    assert store.partitions() == {
+        date(2020, 11, 26): f"{store.table}_20201126",
+        date(2020, 11, 27): f"{store.table}_20201127",
+    }
+
+
+def test_copy_escapes(store):
+    value = "tab\there\nnewline\r\\N back\\slash"
+    store.write([_row(26, 10, value=value)])
+    store.flush()
+    assert _values(store) == [(26, value)]
+
+
+def test_partitions_known_after_create(store):
+    store.write([_row(26, 10)])
+    store.flush()
+    other = pgstore.PartitionedStore(DATABASE, store.table)
+    other.create()
+    other.write([_row(26, 11)])
+    assert other.flush() == 1  # Does not try to create the partition again.
+    other.engine.dispose()
+    assert len(_values(store)) == 2
+
+
+def test_drop_before(store):
+    store.write([_row(25, 12), _row(26, 12), _row(27, 12)])
+    store.flush()
+    assert store.drop_before(date(2020, 11, 25)) == []
+    assert store.drop_before(date(2020, 11, 27)) == [
+        f"{store.table}_20201125",
+        f"{store.table}_20201126",
+    ]
+    assert list(store.partitions()) == [date(2020, 11, 27)]
+    assert _values(store) == [(27, "1")]
+    # A dropped day gets its partition back.
+    store.write([_row(25, 13)])
+    store.flush()
+    assert _values(store) == [(25, "1"), (27, "1")]
+
+
+def test_naive_timestamps_are_utc(store, monkeypatch):
+    monkeypatch.setenv("PGTZ", "America/New_York")  # Read by libpq.
+    other = pgstore.PartitionedStore(DATABASE, store.table)
+    other.create()
+    row = _row(26, 23)
+    row["timestamp"] = row["timestamp"].replace(tzinfo=None)
+    other.write([row])
+    assert other.flush() == 1
+    other.engine.dispose()
+    assert _values(store) == [(26, "1")]
+    assert list(store.partitions()) == [date(2020, 11, 26)]
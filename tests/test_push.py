@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the `push.PushServer` requests."""
+
+import asyncio
+import json
+
+import pytest
+
+from snmp_adapter.experiments import push
+
+
+@pytest.fixture
+def loop():
+    """An event loop that fails the test on unhandled exceptions."""
+    loop = asyncio.new_event_loop()
+    unhandled = []
+    loop.set_exception_handler(lambda loop, context: unhandled.append(context))
+    yield loop
+    loop.close()
+    assert unhandled == []
+
+
+async def _get(device, objects):
+    if device == "dead":
+        raise ValueError("No answer.")
+    return [[oid, oid, "1"] for oid in objects]
+
+
+async def _history(source=None, limit=None):
+    return [{"source": source}]
+
+
+def _exchange(loop, path, *messages):
+    """Sends the messages to a server on path, returns the replies by id."""
+
+    async def exchange():
+        server = push.PushServer(get_handler=_get, history_handler=_history)
+        await server.start(path=path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        for message in messages:
+            payload = json.dumps(message).encode("utf-8")
+            writer.write(push._LENGTH.pack(len(payload)) + payload)
+        replies = {}
+        for _ in messages:
+            length = push._LENGTH.unpack(await reader.readexactly(4))[0]
+            reply = json.loads(await reader.readexactly(length))
+            replies[reply.get("id")] = reply
+        writer.close()
+        await server.stop()
+        return replies
+
+    return loop.run_until_complete(asyncio.wait_for(exchange(), 5))
+
+
+def test_get(loop, tmp_path):
+    replies = _exchange(
+        loop,
+        str(tmp_path / "push.sock"),
+        {"get": {"device": "x410", "objects": ["XYTRONIX-MIB::temp.0"]}, "id": 1},
+        {"get": {"device": "dead"}, "id": 2},
+        {"history": {"source": "192.168.0.132"}, "id": 3},
+    )
+    assert replies[1]["type"] == "get"
+    assert replies[1]["source"] == "x410"
+    assert replies[1]["var_binds"] == [["XYTRONIX-MIB::temp.0"] * 2 + ["1"]]
+    assert replies[2]["error"] == "ValueError: No answer."
+    assert replies[3]["traps"] == [{"source": "192.168.0.132"}]
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        {"get": {"objects": ["XYTRONIX-MIB::temp.0"]}, "id": 7},
+        {"get": "x410", "id": 7},
+        {"get": {"device": "x410", "objects": "XYTRONIX-MIB::temp.0"}, "id": 7},
+        {"subscribe": {"source": "*"}, "id": 7},
+        {"subscribe": ["*"], "id": 7},
+        {"history": [], "id": 7},
+        [{"get": {"device": "x410"}}],
+        ["get"],
+        5,
+    ],
+)
+def test_malformed(loop, tmp_path, message):
+    replies = _exchange(
+        loop,
+        str(tmp_path / "push.sock"),
+        message,
+        {"get": {"device": "x410"}, "id": 8},  # Still answered.
+    )
+    (reply_id,) = set(replies) - {8}
+    assert reply_id == (7 if isinstance(message, dict) else None)
+    assert replies[reply_id]["type"] == "error"
+    assert replies[reply_id]["error"]
+    assert replies[8]["var_binds"] == []
+
+
+def test_bad_history_filter(loop, tmp_path):
+    replies = _exchange(
+        loop, str(tmp_path / "push.sock"), {"history": {"color": "red"}, "id": 9}
+    )
+    assert replies[9]["type"] == "history"
+    assert replies[9]["error"].startswith("TypeError")
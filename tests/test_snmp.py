@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the OID description cache in `snmp`."""
+
+from snmp_adapter.experiments import snmp
+
+
+def test_describe():
+    assert snmp._describe((1, 3, 6, 1, 2, 1, 1, 3, 0)) == (
+        "1.3.6.1.2.1.1.3.0",
+        "SNMPv2-MIB::sysUpTime.0",
+    )
+
+
+def test_describe_cache_bounded(monkeypatch):
+    monkeypatch.setattr(snmp, "_descriptions", {})
+    monkeypatch.setattr(snmp, "MAX_DESCRIPTIONS", 2)
+    for index in range(5):
+        dotted, _ = snmp._describe((1, 3, 6, 1, 4, 1, 99999, index))
+        assert dotted == f"1.3.6.1.4.1.99999.{index}"
+    assert list(snmp._descriptions) == [
+        (1, 3, 6, 1, 4, 1, 99999, 0),
+        (1, 3, 6, 1, 4, 1, 99999, 1),
+    ]
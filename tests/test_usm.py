@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `usm.KeyCache` and the USM users of trap receivers."""
+
+import os
+import stat
+
+import pytest
+from pysnmp.entity import config, engine
+from pysnmp.proto import rfc1902
+
+from snmp_adapter.experiments import usm
+
+ENGINE_ID = "000000000000000000000002"  # From the RFC 3414 A.3 examples.
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "keys.json")
+
+
+@pytest.mark.parametrize(
+    "auth_protocol, master_key, localized_key",
+    [
+        (
+            "MD5",
+            "9faf3283884e92834ebc9847d8edd963",
+            "526f5eed9fcce26f8964c2930787d82b",
+        ),
+        (
+            "SHA",
+            "9fb5cc0381497b3793528939ff788d5d79145211",
+            "6695febc9288e36282235fc7151f128497b38f3f",
+        ),
+    ],
+)
+def test_rfc3414_keys(path, auth_protocol, master_key, localized_key):
+    user = usm.make_user("user", "maplesyrup", auth_protocol=auth_protocol)
+    key_cache = usm.KeyCache(path)
+    assert key_cache.master_keys(user) == (bytes.fromhex(master_key), None)
+    assert key_cache.localized_keys(user, ENGINE_ID) == (
+        bytes.fromhex(localized_key),
+        None,
+    )
+
+
+def _no_hashing(monkeypatch):
+    """Makes any key derivation fail."""
+
+    def fail(*args):
+        raise AssertionError("Key derived, not cached.")
+
+    for service in list(config.authServices.values()) + list(
+        config.privServices.values()
+    ):
+        monkeypatch.setattr(service, "hashPassphrase", fail)
+        monkeypatch.setattr(service, "localizeKey", fail)
+
+
+def test_round_trip(path, monkeypatch):
+    user = usm.make_user("admin", "authpass123", "privpass123")
+    key_cache = usm.KeyCache(path)
+    master_keys = key_cache.master_keys(user)
+    localized_keys = key_cache.localized_keys(user, ENGINE_ID)
+    key_cache.save()
+    _no_hashing(monkeypatch)
+    loaded = usm.KeyCache(path)
+    assert loaded.master_keys(user) == master_keys
+    assert loaded.localized_keys(user, ENGINE_ID.upper()) == localized_keys
+    assert not loaded._dirty  # Nothing new, nothing to save.
+
+
+def test_new_engine_only_localizes(path, monkeypatch):
+    user = usm.make_user("admin", "authpass123", "privpass123")
+    key_cache = usm.KeyCache(path)
+    key_cache.master_keys(user)
+    hashed = []
+    for service in (
+        config.authServices[config.usmHMACSHAAuthProtocol],
+        config.privServices[config.usmAesCfb128Protocol],
+    ):
+        monkeypatch.setattr(
+            service, "hashPassphrase", lambda *args: hashed.append(args)
+        )
+    key_cache.localized_keys(user, "8000000001020304")
+    assert hashed == []
+
+
+def test_changed_pass_phrase(path):
+    key_cache = usm.KeyCache(path)
+    old = key_cache.master_keys(usm.make_user("admin", "authpass123"))
+    key_cache.save()
+    key_cache = usm.KeyCache(path)
+    new = key_cache.master_keys(usm.make_user("admin", "authpass456"))
+    assert new != old
+    assert new == usm.KeyCache(path + ".2").master_keys(
+        usm.make_user("admin", "authpass456")
+    )
+    assert key_cache._dirty
+
+
+def test_salted_fingerprints(path, tmp_path):
+    user = usm.make_user("admin", "authpass123")
+    key_cache = usm.KeyCache(path)
+    key_cache.master_keys(user)
+    other = usm.KeyCache(str(tmp_path / "other.json"))
+    other.master_keys(user)
+    # Pass phrases can not be compared across caches.
+    assert set(key_cache._keys) != set(other._keys)
+    assert all("authpass123" not in entry for entry in key_cache._keys)
+
+
+def test_created_private(path):
+    key_cache = usm.KeyCache(path)
+    key_cache.master_keys(usm.make_user("admin", "authpass123"))
+    key_cache.save()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_saved_private(path):
+    usm.KeyCache(path).save()
+    os.chmod(path, 0o644)
+    key_cache = usm.KeyCache(path)
+    key_cache.master_keys(usm.make_user("admin", "authpass123"))
+    key_cache.save()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def _has_user(snmp_engine, name, engine_id):
+    mib_builder = snmp_engine.msgAndPduDsp.mibInstrumController.mibBuilder
+    (entry,) = mib_builder.importSymbols("SNMP-USER-BASED-SM-MIB", "usmUserEntry")
+    index = entry.getInstIdFromIndices(engine_id, name)
+    try:
+        entry.getNode(entry.name + (3,) + index)
+    except Exception:
+        return False
+    return True
+
+
+def test_add_and_remove_user(path):
+    snmp_engine = engine.SnmpEngine()
+    user = usm.make_user("admin", "authpass123", "privpass123")
+    key_cache = usm.KeyCache(path)
+    agent = rfc1902.OctetString(hexValue="8000000001020304")
+    usm.add_user(snmp_engine, user, key_cache, ["8000000001020304"])
+    assert _has_user(snmp_engine, "admin", snmp_engine.snmpEngineID)
+    assert _has_user(snmp_engine, "admin", agent)
+    assert os.path.exists(path)  # Saved, keys and all.
+    usm.remove_user(snmp_engine, "admin", ["8000000001020304"])
+    assert not _has_user(snmp_engine, "admin", snmp_engine.snmpEngineID)
+    assert not _has_user(snmp_engine, "admin", agent)